@@ -0,0 +1,236 @@
+from __future__ import division
+import multiprocessing
+import Queue
+
+import tensorflow as tf
+import numpy as np
+
+from constants import seq_length, replay_mem_start_size, replay_memory_max_size
+from snf import SNFBank, load_snfs
+from replay_memory import create_replay_memory
+from optimizer import Optimizer
+from profiling import null_timer
+
+
+def rollout(sess, opt_net, replay_memory, batch_size, accumulate=False, timer=null_timer):
+	"""
+	Unrolls the optimizer from a batch of states sampled from the replay memory and puts
+	the resulting states back into it.
+	Returns the loss, the average loss change sign and counter, and the gradients of the loss.
+	If accumulate is True the gradients are instead added to the optimizer's accumulators 
+	and None is returned in their place.
+	The time spent in each phase is recorded by timer.
+	"""
+	# Retrieve random starting points from the replay memory
+	# States at the end of their episode are reset
+	with timer.phase('sample'):
+		batch = replay_memory.sample(batch_size)
+	with timer.phase('unroll'):
+		res = unroll(sess, opt_net, batch, accumulate)
+	with timer.phase('store'):
+		indices, _, _, _, counters, snf_ids = batch
+		return store_unroll(replay_memory, indices, counters, snf_ids, res, accumulate)
+	
+	
+def prefetched_rollout(sess, opt_net, prefetcher, accumulate=False, timer=null_timer):
+	""" Same as rollout but the batch is dequeued from the prefetcher the Optimizer was built with """
+	indices, _, _, _, counters, snf_ids = prefetcher.batch
+	
+	if accumulate:
+		grad_ops = [opt_net.accumulate]
+	else:
+		grad_ops = [g for g,v in opt_net.gvs]
+		
+	# The points and RNN states of the batch stay in the graph, only its metadata is fetched
+	# Sampling happens in the background, waiting for the queue counts as part of the unroll
+	with timer.phase('unroll'):
+		res = sess.run([indices, counters, snf_ids,
+						opt_net.new_point,
+						opt_net.rnn_state_out,
+						opt_net.loss_change_sign,
+						opt_net.total_loss,
+						opt_net.total_losses]
+						+ grad_ops)
+	indices, counters, snf_ids = res[0:3]
+	
+	with timer.phase('store'), prefetcher.lock:
+		return store_unroll(prefetcher.replay_memory, indices, counters, snf_ids, res[3:], accumulate)
+	
+	
+def threaded_rollout(sess, opt_net, replay_memory, batch_size, thread_pool, num_threads, timer=null_timer):
+	"""
+	Same as rollout but the batch is split into num_threads parts which are unrolled 
+	concurrently. Sampling, storing the new states and averaging the gradients all happen 
+	in this thread in a fixed order, so only the sess.run calls overlap. The weight noise of 
+	each part is drawn here too rather than by the random ops the parts would share, so the 
+	results only depend on the NumPy seed.
+	"""
+	assert batch_size % num_threads == 0, "The batch size must be divisible by the number of threads"
+	part_size = batch_size//num_threads
+	
+	with timer.phase('sample'):
+		batches = [replay_memory.sample(part_size) for j in range(num_threads)]
+		weight_noises = [opt_net.weight_noise_feed(part_size) for j in range(num_threads)]
+	with timer.phase('unroll'):
+		# In the order of batches
+		results = thread_pool.map(lambda j: unroll(sess, opt_net, batches[j], weight_noise=weight_noises[j]), range(num_threads))
+	with timer.phase('store'):
+		stored = []
+		for batch,res in zip(batches,results):
+			indices, _, _, _, counters, snf_ids = batch
+			stored.append(store_unroll(replay_memory, indices, counters, snf_ids, res))
+		results = stored
+	
+	with timer.phase('grad_average'):
+		losses, loss_change_signs, counters, grads = zip(*results)
+		total_grads = [np.mean(g, axis=0) for g in zip(*grads)]
+	return np.mean(losses), np.mean(loss_change_signs), np.mean(counters), total_grads
+	
+	
+def unroll(sess, opt_net, batch, accumulate=False, weight_noise=None):
+	""" 
+	Runs the optimizer on a batch returned by ReplayMemory.sample. weight_noise is an optional
+	feed returned by Optimizer.weight_noise_feed.
+	"""
+	_, sample_weights, points, rnn_states, _, snf_ids = batch
+
+	# The whole batch is unrolled in a single run
+	feed_dict = {opt_net.point: points,
+					opt_net.snf_index: snf_ids,
+					opt_net.rnn_states: rnn_states,
+					opt_net.sample_weights: sample_weights}
+	if weight_noise is not None:
+		feed_dict.update(weight_noise)
+
+	if accumulate:
+		grad_ops = [opt_net.accumulate]
+	else:
+		grad_ops = [g for g,v in opt_net.gvs]
+
+	return sess.run([opt_net.new_point,
+					opt_net.rnn_state_out,
+					opt_net.loss_change_sign,
+					opt_net.total_loss,
+					opt_net.total_losses]
+					+ grad_ops,
+					feed_dict=feed_dict)
+					
+					
+def store_unroll(replay_memory, indices, counters, snf_ids, res, accumulate=False):
+	"""
+	Adds the states reached by an unroll to the replay memory and summarizes its results.
+	indices, counters and snf_ids are those of the batch which was unrolled.
+	"""
+	new_points, rnn_states_out, loss_change_sign, loss, total_losses = res[0:5]
+	total_grads = None if accumulate else res[5:]
+
+	replay_memory.update_priorities(indices, total_losses)
+
+	# Only the last state of each unroll is added. Adding more may result in a loss
+	# of diversity in the replay memory
+	replay_memory.add(new_points, rnn_states_out, counters + seq_length, snf_ids)
+
+	return loss, np.mean(loss_change_sign), np.mean(counters), total_grads
+
+
+class WeightSync(object):
+	""" Reads and overwrites the weights of the optimizer so they can be sent between processes """
+
+	def __init__(self):
+		self.vars = [v for v in tf.trainable_variables() if v.name.startswith('optimizer/')]
+		self.placeholders = [tf.placeholder(v.dtype.base_dtype, v.get_shape()) for v in self.vars]
+		self.assign = tf.group(*[v.assign(p) for v,p in zip(self.vars, self.placeholders)])
+
+	def get(self, sess):
+		return sess.run(self.vars)
+
+	def set(self, sess, weights):
+		sess.run(self.assign, feed_dict=dict(zip(self.placeholders, weights)))
+
+
+def run_actor(actor_id, batch_size, memory_size, snf_path, seed, weights_queue, results_queue):
+	"""
+	Process which generates rollouts with its own graph, session and replay memory,
+	using the latest weights broadcast by the learner. Stops when it receives None.
+	seed is the seed of this actor, if it is None the actor seeds itself from the OS.
+	"""
+	# Forked processes inherit the learner's random state, so each actor is reseeded 
+	# to explore different states
+	np.random.seed(seed)
+	if seed is not None:
+		tf.set_random_seed(seed)
+
+	snfs = load_snfs(snf_path)
+	snf_bank = SNFBank(snfs)
+	opt_net = Optimizer(snf_bank)
+	weight_sync = WeightSync()
+
+	sess = tf.Session()
+	sess.run(tf.initialize_all_variables())
+
+	replay_memory = create_replay_memory(memory_size, memory_size*replay_mem_start_size//replay_memory_max_size, len(snfs))
+	weights = weights_queue.get()
+
+	while weights is not None:
+		weight_sync.set(sess, weights)
+		results_queue.put(rollout(sess, opt_net, replay_memory, batch_size))
+
+		# Use the newest weights broadcast by the learner, if there are any
+		try:
+			while True:
+				weights = weights_queue.get_nowait()
+				if weights is None:
+					break
+		except Queue.Empty:
+			pass
+
+
+class ActorPool(object):
+	"""
+	Runs rollouts in num_actors worker processes. Each actor unrolls an equal share of the batch
+	and sends the resulting gradients to the learner through a queue of its own. The learner
+	averages one result of every actor and periodically broadcasts its weights back to them.
+	The actors are seeded from seed, the seed of the run, if it is given.
+
+	The actors must be started before the learner creates its session as sessions cannot be
+	shared with forked processes.
+	"""
+
+	def __init__(self, num_actors, batch_size, snf_path, seed=None):
+		if batch_size % num_actors != 0:
+			raise ValueError("The batch size %d is not divisible by the number of actors %d" % (batch_size, num_actors))
+		self.num_actors = num_actors
+		self.batch_size = batch_size//num_actors
+		memory_size = replay_memory_max_size//num_actors
+		self.weights_queues = [multiprocessing.Queue() for i in range(num_actors)]
+
+		# Bounded so an actor cannot get too far ahead of the learner
+		self.results_queues = [multiprocessing.Queue(maxsize=2) for i in range(num_actors)]
+
+		self.processes = []
+		for i in range(num_actors):
+			actor_seed = None if seed is None else seed + 1 + i # The learner uses seed itself
+			p = multiprocessing.Process(target=run_actor,
+					args=(i, self.batch_size, memory_size, snf_path, actor_seed, self.weights_queues[i], self.results_queues[i]))
+			p.daemon = True
+			p.start()
+			self.processes.append(p)
+
+	def broadcast(self, weights):
+		for q in self.weights_queues:
+			q.put(weights)
+
+	def collect(self):
+		""" Returns the rollout results of one batch, averaged over the actors """
+		results = [q.get() for q in self.results_queues]
+		losses, loss_change_signs, counters, grads = zip(*results)
+		total_grads = [np.mean(g, axis=0) for g in zip(*grads)]
+		return np.mean(losses), np.mean(loss_change_signs), np.mean(counters), total_grads
+
+	def stop(self):
+		self.broadcast(None)
+		for p in self.processes:
+			# An actor may be blocked on its full results queue
+			p.join(timeout=10)
+			if p.is_alive():
+				p.terminate()
@@ -0,0 +1,49 @@
+from __future__ import division
+import time
+
+import tensorflow as tf
+import numpy as np
+
+import rnn_cell
+from constants import rnn_size
+
+"""
+Checks that FusedGRUCell matches GRUCell and compares their speed on as many coordinates
+as the optimizer is applied to
+python bench_gru.py
+"""
+
+num_coords = [10000, 100000, 1000000]
+repeats = 10
+
+sess = tf.Session()
+
+# The cached expected weights make both cells deterministic and leave only the cell's own work
+with rnn_cell.weight_mode('expected'):
+	for n in num_coords:
+		with tf.variable_scope("bench%d" % n) as scope:
+			grads = tf.Variable(tf.random_normal([n,1]), trainable=False)
+			state = tf.Variable(tf.random_normal([n,rnn_size]), trainable=False)
+
+			h,_ = rnn_cell.GRUCell(rnn_size)(grads, state)
+			scope.reuse_variables()
+			h_fused,_ = rnn_cell.FusedGRUCell(rnn_size)(grads, state)
+
+		sess.run(tf.initialize_all_variables())
+		sess.run(rnn_cell.refresh_weights())
+
+		#===# Equivalence #===#
+		res, res_fused = sess.run([h, h_fused])
+		assert np.allclose(res, res_fused, rtol=1e-4, atol=1e-6), "Outputs differ for n=%d" % n
+
+		#===# Speed #===#
+		# The outputs are not fetched so copying them to the host is not timed
+		times = []
+		for op in [tf.group(h), tf.group(h_fused)]:
+			sess.run(op) # Warm up
+			start = time.time()
+			for i in range(repeats):
+				sess.run(op)
+			times.append((time.time() - start)/repeats)
+
+		print "{:>8} coordinates: GRUCell {:>10.3} s, FusedGRUCell {:>10.3} s".format(n, times[0], times[1])
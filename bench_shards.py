@@ -0,0 +1,47 @@
+from __future__ import division
+import time
+
+import tensorflow as tf
+
+from optimizer import Optimizer, ParamLayout
+
+"""
+Measures the latency of a step of the optimizer applied to the parameters of a net as a single
+fused step and split into shards which run on as many inter-op threads, as in compare.py --shards
+python bench_shards.py
+"""
+
+num_params = [100000, 1000000]
+num_shards = [1, 2, 4, 8]
+repeats = 10
+
+# The cached expected weights leave only the work of the cell in the step
+opt_net = Optimizer(training=False, weight_mode='expected')
+
+for n in num_params:
+	times = []
+	for s in num_shards:
+		with tf.variable_scope("bench%d_%d" % (n,s)):
+			# Shaped like the layers of an MLP so the shards end on row boundaries
+			vars = [tf.Variable(tf.random_normal([n//100,100]), trainable=False), tf.Variable(tf.zeros([100]), trainable=False)]
+			layout = ParamLayout(vars)
+			grads = tf.Variable(tf.random_normal([layout.size,1]), trainable=False)
+			
+			if s > 1:
+				train_step,_ = opt_net.sharded_train_step(grads, layout, s)
+			else:
+				rnn_state = tf.Variable(tf.zeros([layout.size, opt_net.state_size]), trainable=False)
+				train_step = opt_net.fused_train_step(grads, rnn_state, layout)
+				
+		sess = tf.Session(config=tf.ConfigProto(inter_op_parallelism_threads=s) if s > 1 else None)
+		sess.run(tf.initialize_all_variables())
+		sess.run(opt_net.refresh_weights)
+		
+		sess.run(train_step) # Warm up
+		start = time.time()
+		for i in range(repeats):
+			sess.run(train_step)
+		times.append((time.time() - start)/repeats)
+		sess.close()
+		
+	print "{:>8} parameters: ".format(n) + ", ".join("{} shards {:>10.3} s".format(s,t) for s,t in zip(num_shards, times))
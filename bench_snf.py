@@ -0,0 +1,44 @@
+from __future__ import division
+import time
+
+import tensorflow as tf
+import numpy as np
+
+from snf import SNF, StateOps, gen_points, stack_snfs, calc_snf_losses_and_grads_np
+
+"""
+Compares the speed of the NumPy SNF engine and the TensorFlow graph, test_snf.py checks that
+they agree
+python bench_snf.py
+"""
+
+num_points = [1, 100, 5000]
+repeats = 10
+
+sess = tf.Session()
+state_ops = StateOps()
+
+snfs = [SNF() for i in range(max(num_points))]
+
+for n in num_points:
+	points = np.transpose(gen_points(n))[:,:,None] # [n,m,1]
+	normals, offsets, variances, weights = stack_snfs(snfs[:n])
+
+	feed_dict = {	state_ops.point: points,
+					state_ops.normals: normals,
+					state_ops.offsets: offsets,
+					state_ops.variances: variances,
+					state_ops.weights: weights}
+
+	#===# Speed #===#
+	start = time.time()
+	for i in range(repeats):
+		sess.run([state_ops.loss, state_ops.grads], feed_dict=feed_dict)
+	tf_time = (time.time() - start)/repeats
+
+	start = time.time()
+	for i in range(repeats):
+		calc_snf_losses_and_grads_np(points, normals, offsets, variances, weights)
+	np_time = (time.time() - start)/repeats
+
+	print "{:>6} points: TF {:>10.3} s, NumPy {:>10.3} s".format(n, tf_time, np_time)
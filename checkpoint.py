@@ -0,0 +1,57 @@
+from __future__ import division
+import os
+
+import numpy as np
+
+from nn_utils import make_parent_dir
+
+
+"""
+A checkpoint of the training state consists of a TensorFlow checkpoint of all variables
+(the opt net, its Adam slots and gradient accumulators and the SNF bank) and a compressed
+.npz file holding the replay memory, the iteration counter, the best accuracy, the path of
+the SNF file and the state of NumPy's random number generator.
+"""
+
+
+def state_path(path):
+	return path + '.state.npz'
+
+
+def save_checkpoint(sess, saver, path, iteration, best_accuracy, snf_path, replay_memory=None):
+	make_parent_dir(path)
+
+	saver.save(sess, path)
+
+	_, rng_keys, rng_pos, rng_has_gauss, rng_cached_gauss = np.random.get_state()
+	state = {'iteration': iteration, 'best_accuracy': best_accuracy, 'snf_path': snf_path,
+			'rng_keys': rng_keys, 'rng_pos': rng_pos, 'rng_has_gauss': rng_has_gauss,
+			'rng_cached_gauss': rng_cached_gauss}
+
+	if replay_memory is not None:
+		for key,value in replay_memory.get_state().items():
+			state['replay_' + key] = value
+
+	# Written to a temporary file first so a crash cannot leave a partial checkpoint
+	tmp_path = state_path(path) + '.tmp.npz'
+	np.savez_compressed(tmp_path, **state)
+	os.rename(tmp_path, state_path(path))
+
+
+def load_checkpoint(sess, saver, path, replay_memory=None):
+	""" Restores a checkpoint written by save_checkpoint. Returns the iteration and best accuracy. """
+	saver.restore(sess, path)
+
+	state = np.load(state_path(path))
+	np.random.set_state(('MT19937', state['rng_keys'], int(state['rng_pos']),
+						int(state['rng_has_gauss']), float(state['rng_cached_gauss'])))
+
+	if replay_memory is not None:
+		replay_memory.set_state(dict((key[len('replay_'):], state[key]) for key in state.files if key.startswith('replay_')))
+
+	return int(state['iteration']), float(state['best_accuracy'])
+
+
+def checkpoint_snf_path(path):
+	""" Path of the SNF file used by the run a checkpoint was taken from """
+	return str(np.load(state_path(path))['snf_path'])
@@ -1,29 +1,28 @@
 from __future__ import division
+import argparse
 
 import tensorflow as tf
 from tensorflow.examples.tutorials.mnist import input_data
-import numpy as np
 
 from mlp import MLP
 from mlp_relu import MLP_RELU
 from cnn import CNN
-from optimizer import Optimizer
-from constants import summaries_dir, save_path, seq_length
+from inference import add_optimizer_arguments, load_optimizer
+from profiling import Tracer
+from constants import summaries_dir, seq_length
 
 """
 tensorboard --logdir=/tmp/logs ./ --host 0.0.0.0
 http://ec2-52-48-79-131.eu-west-1.compute.amazonaws.com:6006/
 """
 
-sess = tf.Session()
-	
-opt_net = Optimizer()
-	
-# Load model
-saver = tf.train.Saver(tf.trainable_variables())
-saver.restore(sess, save_path)
+parser = argparse.ArgumentParser()
+add_optimizer_arguments(parser)
+args = parser.parse_args()
+tracer = Tracer(args.trace_steps, args.trace_dir)
+sess, opt_net = load_optimizer(parser, args)
 
-net = MLP_RELU(opt_net)
+net = MLP_RELU(opt_net, args.num_shards, args.streaming)
 
 print "\nRunning optimizer comparison..."
 
@@ -44,7 +43,7 @@ mnist = input_data.read_data_sets("MNIST_data/", one_hot=True)
 sess.run(net.init) # Reset parameters of net to be trained
 for i in range(net.batches):
 	batch_x, batch_y = mnist.train.next_batch(net.batch_size)
-	summary,_ = sess.run([merged, net.sgd_train_step], feed_dict={net.x: batch_x, net.y_: batch_y})
+	summary,_ = tracer.session(sess, i, 'sgd').run([merged, net.sgd_train_step], feed_dict={net.x: batch_x, net.y_: batch_y})
 	sgd_writer.add_summary(summary,i)
 accuracy = sess.run(net.accuracy, feed_dict={net.x: mnist.test.images, net.y_: mnist.test.labels})
 print "SGD accuracy: %f" % accuracy
@@ -54,31 +53,30 @@ sgd_writer.close()
 sess.run(net.init) # Reset parameters of net to be trained
 for i in range(net.batches):
 	batch_x, batch_y = mnist.train.next_batch(net.batch_size)
-	summary,_ = sess.run([merged, net.adam_train_step], feed_dict={net.x: batch_x, net.y_: batch_y})
+	summary,_ = tracer.session(sess, i, 'adam').run([merged, net.adam_train_step], feed_dict={net.x: batch_x, net.y_: batch_y})
 	adam_writer.add_summary(summary,i)
 accuracy = sess.run(net.accuracy, feed_dict={net.x: mnist.test.images, net.y_: mnist.test.labels})
 print "Adam accuracy: %f" % accuracy
 adam_writer.close()
 
 # GRU optimizer
-sess.run(net.init) # Reset parameters of the net to be trained
-rnn_state = np.zeros([net.num_params, net.opt_net.cell.state_size])
+sess.run(net.init) # Reset parameters and opt net state of the net to be trained
+if args.streaming:
+	net.streaming_optimizer.reset()
 
 for i in range(net.batches):
 	batch_x, batch_y = mnist.train.next_batch(net.batch_size)
 	
-	# Compute gradients
-	summary, grads = sess.run([merged, net.grads], feed_dict={net.x:batch_x, net.y_:batch_y})
-	
-	# Compute update
-	feed_dict = {net.opt_net.input_grads: np.reshape(grads,[1,-1,1]), 
-				net.opt_net.initial_rnn_state: rnn_state}
-	[update, rnn_state] = sess.run([net.opt_net.update, net.opt_net.rnn_state_out_compare], feed_dict=feed_dict)
-	
-	# Update MLP parameters
-	_ = sess.run([net.opt_net_train_step], feed_dict={net.update:update})	
+	# Compute gradients, compute the update and apply it in one run
+	run_sess = tracer.session(sess, i, 'opt_net')
+	if args.streaming:
+		[summary] = net.streaming_optimizer.step(run_sess, {net.x:batch_x, net.y_:batch_y}, [merged])
+	else:
+		summary,_ = run_sess.run([merged, net.opt_net_train_step], feed_dict={net.x:batch_x, net.y_:batch_y})
 	opt_net_writer.add_summary(summary,i)
 	
 accuracy = sess.run(net.accuracy, feed_dict={net.x: mnist.test.images, net.y_: mnist.test.labels})
 print "Opt net accuracy: %f" % accuracy
 opt_net_writer.close()
+if args.streaming:
+	net.streaming_optimizer.close()
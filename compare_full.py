@@ -1,4 +1,5 @@
 from __future__ import division
+import argparse
 
 import tensorflow as tf
 from tensorflow.examples.tutorials.mnist import input_data
@@ -8,8 +9,10 @@ from mlp import MLP
 from mlp_relu import MLP_RELU
 #from cnn import CNN
 #from lm import LM
-from optimizer import Optimizer
-from constants import summaries_dir, save_path, seq_length
+from inference import add_optimizer_arguments, load_optimizer
+from profiling import Tracer
+from training_loop import Dataset, build_training_loop
+from constants import summaries_dir, seq_length
 
 """
 rm nohup.out; nohup python -u compare_full.py &
@@ -19,14 +22,16 @@ http://ec2-52-48-79-131.eu-west-1.compute.amazonaws.com:6006/
 
 runs = 1 ###
 
-sess = tf.Session()
-opt_net = Optimizer()
-	
-# Load model
-saver = tf.train.Saver(tf.trainable_variables())
-saver.restore(sess, save_path)
+parser = argparse.ArgumentParser()
+add_optimizer_arguments(parser)
+parser.add_argument('--in-graph', dest='in_graph', action='store_true', help='Run each optimizer for a whole run in a single call')
+args = parser.parse_args()
+if args.in_graph and (args.num_shards > 1 or args.streaming):
+	parser.error('--in-graph keeps a single RNN state and cannot be combined with --shards or --streaming')
+tracer = Tracer(args.trace_steps, args.trace_dir)
+sess, opt_net = load_optimizer(parser, args)
 
-net = MLP(opt_net)
+net = MLP(opt_net, args.num_shards, args.streaming)
 sess.run(net.init)
 
 print "\nRunning optimizer comparison..."
@@ -34,46 +39,63 @@ results = np.zeros([net.batches,5])
 
 mnist = input_data.read_data_sets("MNIST_data/", one_hot=True)
 
-def test_inbuilt_optimizer(opt_step, index):
+def test_inbuilt_optimizer(opt_step, index, name):
 	for i in range(runs):
 		sess.run(net.init) # Reset parameters of net to be trained
 		for j in range(net.batches):
 			batch_x, batch_y = mnist.train.next_batch(net.batch_size)
-			train_loss,_ = sess.run([net.loss, opt_step], feed_dict={net.x: batch_x, net.y_: batch_y})
+			train_loss,_ = tracer.session(sess, j, name).run([net.loss, opt_step], feed_dict={net.x: batch_x, net.y_: batch_y})
 			results[j,index] += train_loss
 			results[j,0] = j
 		#accuracy = sess.run(net.accuracy, feed_dict={net.x: mnist.test.images, net.y_: mnist.test.labels})	
 	return
 	
-test_inbuilt_optimizer(net.sgd_train_step,1)
-print "SGD complete"
-test_inbuilt_optimizer(net.rmsprop_train_step,2)
-print "RMSProp complete"
-test_inbuilt_optimizer(net.adam_train_step,3)
-print "Adam complete"
-
-for i in range(runs):
-	sess.run(net.init) # Reset parameters of the net to be trained
-	rnn_state = np.zeros([net.num_params, net.opt_net.cell.state_size])
-	print i
-	for j in range(net.batches):
-		batch_x, batch_y = mnist.train.next_batch(net.batch_size)
-		
-		# Compute gradients
-		train_loss, grads = sess.run([net.loss, net.grads], feed_dict={net.x:batch_x, net.y_:batch_y})
-		results[j,4] += train_loss
-		
-		# Compute update
-		feed_dict = {net.opt_net.input_grads: np.reshape(grads,[1,-1,1]), 
-					net.opt_net.initial_rnn_state: rnn_state}
-		[update, rnn_state] = sess.run([net.opt_net.update, net.opt_net.rnn_state_out_compare], feed_dict=feed_dict)
-		
-		# Update MLP parameters
-		sess.run([net.opt_net_train_step], feed_dict={net.update:update})
-		
-	#accuracy = sess.run(net.accuracy, feed_dict={net.x: mnist.test.images, net.y_: mnist.test.labels})
-	#print "Opt net accuracy: %f" % accuracy
-print "Opt net complete"
+def test_in_graph(losses, index, name):
+	for i in range(runs):
+		sess.run(net.init) # Reset parameters and opt net state of the net to be trained
+		results[:,index] += tracer.session(sess, 0, name).run(losses) # The whole run is step 0
+	results[:,0] = np.arange(net.batches)
+	
+if args.in_graph:
+	# The batches are drawn in the graph from a copy of the training set
+	dataset = Dataset(mnist.train.num_examples)
+	optimizers = [net.sgd_optimizer, net.rmsprop_optimizer, net.adam_optimizer, None] # None is the opt net
+	loop_losses = [build_training_loop(net, dataset, net.batches, opt) for opt in optimizers]
+	dataset.load(sess, mnist.train.images, mnist.train.labels)
+	
+	for index,name in enumerate(['sgd', 'rmsprop', 'adam', 'opt_net']):
+		test_in_graph(loop_losses[index], index+1, name)
+		print "%s complete" % name
+else:
+	test_inbuilt_optimizer(net.sgd_train_step,1,'sgd')
+	print "SGD complete"
+	test_inbuilt_optimizer(net.rmsprop_train_step,2,'rmsprop')
+	print "RMSProp complete"
+	test_inbuilt_optimizer(net.adam_train_step,3,'adam')
+	print "Adam complete"
+	
+	for i in range(runs):
+		sess.run(net.init) # Reset parameters and opt net state of the net to be trained
+		if args.streaming:
+			net.streaming_optimizer.reset()
+		print i
+		for j in range(net.batches):
+			batch_x, batch_y = mnist.train.next_batch(net.batch_size)
+			
+			# Compute gradients, compute the update and apply it in one run
+			# The loss is computed before the update is applied
+			run_sess = tracer.session(sess, j, 'opt_net')
+			if args.streaming:
+				[train_loss] = net.streaming_optimizer.step(run_sess, {net.x:batch_x, net.y_:batch_y}, [net.loss])
+			else:
+				train_loss,_ = run_sess.run([net.loss, net.opt_net_train_step], feed_dict={net.x:batch_x, net.y_:batch_y})
+			results[j,4] += train_loss
+			
+		#accuracy = sess.run(net.accuracy, feed_dict={net.x: mnist.test.images, net.y_: mnist.test.labels})
+		#print "Opt net accuracy: %f" % accuracy
+	print "Opt net complete"
+	if args.streaming:
+		net.streaming_optimizer.close()
 	
 results /= runs
 
@@ -4,7 +4,14 @@ import numpy as np
 
 #===# Logging constants #===#
 summaries_dir = '/tmp/logs'
+trace_dir = '/tmp/traces'
 save_path = 'models/model.ckpt'
+frozen_path = 'models/optimizer.pb' # Written by inference.py, the opt net with its weights as constants
+checkpoint_path = 'models/checkpoint.ckpt' # Full training state, used by --resume
+checkpoint_freq = 100 # Iterations between checkpoints of the training state
+candidate_dir = 'models/candidates' # Models waiting to be evaluated by evaluator.py
+eval_freq = 10 # Iterations between candidate models
+eval_poll_interval = 5 # Seconds between checks for a new candidate
 summary_freq = 5
 
 #===# Opt net constants #===#
@@ -12,21 +19,38 @@ rnn_types = ['rnn','gru','lstm']
 rnn_type = rnn_types[1]
 rnn_size = 20
 num_rnn_layers = 1
+# Default weights of the opt net's cells outside of training, see rnn_cell.weight_mode.
+# The scripts which apply the opt net select the others with --weights.
+weight_modes = ['sample','expected','snapshot']
+inference_weight_mode = weight_modes[0]
+streaming_chunk_size = 1000000 # Parameters per chunk when the optimizer is applied in chunks
 
 #===# SNF constants #===#
 k = 10 # Number of hyperplanes
 m = 30 # Number of dimensions
 var_size = 0.2
+snf_seed = 0
+snf_path = 'data/snfs.npy'
+max_hyperplane_cond = 1e4 # SNFs with a worse conditioned hyperplane matrix are redrawn
 
 #===# Training constants #===#
 batch_size = 250
+accumulation_steps = 1 # Micro-batches per batch, their gradients are accumulated in the graph
+prefetch_capacity = 4 # Batches staged ahead of the training loop when prefetching
 seq_length = 10
 num_iterations = 10000
 num_SNFs = 1000
 loss_asymmetry = 2.0
 replay_mem_start_size = 5000
 replay_memory_max_size = 100000
+replay_memory_dtypes = ['float64','float32','float16'] # float16 quarters the memory of float64 at a loss of precision
+replay_memory_dtype = replay_memory_dtypes[1] # Storage type of the points and RNN states
+prioritized_replay = False # Sample states in proportion to the loss of their last unroll
+priority_alpha = 0.6 # 0 is uniform sampling
+priority_beta = 0.4 # Strength of the importance weight correction, 1 is full correction
+priority_eps = 1e-3
 episode_length = 100 # SNF states are reset after this many steps
+weight_sync_freq = 1 # Iterations between broadcasts of the weights to the rollout actors
 
 grad_scaling_methods = ['none','full']
 grad_scaling_method = grad_scaling_methods[0]
@@ -0,0 +1,133 @@
+from __future__ import division
+import argparse
+import os
+import time
+
+import tensorflow as tf
+from tensorflow.examples.tutorials.mnist import input_data
+
+from constants import save_path, candidate_dir, eval_poll_interval, weight_modes, inference_weight_mode
+from optimizer import Optimizer
+from mlp import MLP
+
+"""
+Evaluates the optimizer checkpoints written by 'python main.py -s' on the MNIST MLP,
+without blocking the training process. The best one is copied to save_path.
+main.py starts this automatically, it can also be run on its own:
+python evaluator.py
+"""
+
+CANDIDATE_PREFIX = 'candidate.ckpt'
+LATEST_FILENAME = 'candidates'
+STOP_FILENAME = 'stop' # Written by the trainer once its last candidate has been saved
+
+
+def candidate_path(dir_name):
+	return os.path.join(dir_name, CANDIDATE_PREFIX)
+
+
+def accuracy_path(path):
+	return path + '.accuracy'
+
+
+def read_best_accuracy(path=save_path):
+	""" Best accuracy reported by the evaluator, 0 if there is none yet """
+	try:
+		with open(accuracy_path(path)) as f:
+			return float(f.read())
+	except (IOError, ValueError):
+		return 0
+
+
+def clear_candidates(dir_name, path=save_path):
+	""" Removes the candidates and best accuracy of a previous run so they are not mistaken for this run's """
+	for filename in os.listdir(dir_name):
+		if filename.startswith(CANDIDATE_PREFIX) or filename in [LATEST_FILENAME, STOP_FILENAME]:
+			os.remove(os.path.join(dir_name, filename))
+	if os.path.exists(accuracy_path(path)):
+		os.remove(accuracy_path(path))
+
+
+def request_stop(dir_name):
+	open(os.path.join(dir_name, STOP_FILENAME), 'w').close()
+
+
+def is_running(pid):
+	try:
+		os.kill(pid, 0)
+	except OSError:
+		return False
+	return True
+
+
+def evaluate(sess, net, mnist):
+	""" Trains the net with the optimizer and returns its test accuracy """
+	sess.run(net.init) # Reset parameters and opt net state of the net to be trained
+
+	for _ in range(net.batches):
+		batch_x, batch_y = mnist.train.next_batch(net.batch_size)
+
+		# Compute gradients, compute the update and apply it in one run
+		sess.run(net.opt_net_train_step, feed_dict={net.x:batch_x, net.y_:batch_y})
+
+	return sess.run(net.accuracy, feed_dict={net.x: mnist.test.images, net.y_: mnist.test.labels})
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--candidates', dest='candidate_dir', default=candidate_dir)
+	parser.add_argument('--resume', dest='resume', action='store_true', help='Only promote candidates better than the current best model')
+	parser.add_argument('--trainer-pid', dest='trainer_pid', type=int, default=None, help='Stop if this process exits')
+	parser.add_argument('--weights', dest='weight_mode', choices=weight_modes, default=inference_weight_mode, help='Weights of the optimizer\'s cells, see rnn_cell.weight_mode')
+	args = parser.parse_args()
+
+	sess = tf.Session()
+	opt_net = Optimizer(training=False, weight_mode=args.weight_mode) # Only the parts applied to the MLP
+	opt_vars = tf.trainable_variables()
+	saver = tf.train.Saver(opt_vars)
+
+	mnist = input_data.read_data_sets("MNIST_data/", one_hot=True)
+	net = MLP(opt_net)
+
+	best_accuracy = read_best_accuracy() if args.resume else 0
+	last_evaluated = None
+
+	while True:
+		# Checked before looking for a candidate so the last one is always evaluated
+		stop = os.path.exists(os.path.join(args.candidate_dir, STOP_FILENAME))
+		if args.trainer_pid is not None and not is_running(args.trainer_pid):
+			stop = True
+
+		# Only the newest candidate is evaluated, older ones are skipped
+		path = tf.train.latest_checkpoint(args.candidate_dir, latest_filename=LATEST_FILENAME)
+
+		if path is not None and path != last_evaluated:
+			try:
+				saver.restore(sess, path)
+			except tf.errors.NotFoundError:
+				# Deleted by the trainer in the meantime, a newer one exists or is being written
+				time.sleep(eval_poll_interval)
+				continue
+			sess.run(opt_net.refresh_weights) # The cached weights must follow the restored candidate
+			last_evaluated = path
+
+			a = evaluate(sess, net, mnist)
+			iteration = path.split('-')[-1]
+
+			if a > best_accuracy:
+				best_accuracy = a
+				saver.save(sess, save_path) # Promote the candidate
+				with open(accuracy_path(save_path), 'w') as f:
+					f.write(str(best_accuracy))
+				print "{:>6}{:>10.3} (S)".format(iteration, a)
+			else:
+				print "{:>6}{:>10.3}".format(iteration, a)
+
+		elif stop:
+			break
+		else:
+			time.sleep(eval_poll_interval)
+
+
+if __name__ == "__main__":
+	main()
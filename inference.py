@@ -0,0 +1,110 @@
+from __future__ import division
+import argparse
+
+import tensorflow as tf
+from tensorflow.python.framework import graph_util
+
+from constants import save_path, frozen_path, trace_dir, weight_modes, inference_weight_mode
+from optimizer import Optimizer, OptimizerBase
+from nn_utils import make_parent_dir
+
+"""
+Exports a saved optimizer as a frozen GraphDef, in which its weights are constants, so jobs
+which only apply it can load it without building the optimizer in Python:
+python inference.py
+"""
+
+# Names of the inputs and outputs of the frozen graph
+GRADS = 'grads'
+RNN_STATE = 'rnn_state'
+UPDATE = 'update'
+RNN_STATE_OUT = 'rnn_state_out'
+
+
+def export_frozen_optimizer(model_path=save_path, path=frozen_path, weight_mode=inference_weight_mode):
+	# Built in a graph of its own so the names are exactly the ones above
+	graph = tf.Graph()
+	with graph.as_default():
+		opt_net = Optimizer(training=False, weight_mode=weight_mode)
+		grads = tf.placeholder(tf.float32, [None,1], GRADS)
+		rnn_state = tf.placeholder(tf.float32, [None,opt_net.state_size], RNN_STATE)
+		update, rnn_state_out = opt_net.calc_update(grads, rnn_state)
+		tf.identity(update, name=UPDATE)
+		tf.identity(rnn_state_out, name=RNN_STATE_OUT)
+
+		sess = tf.Session()
+		tf.train.Saver(tf.trainable_variables()).restore(sess, model_path)
+		sess.run(opt_net.refresh_weights) # Cached weights become constants too
+		graph_def = graph_util.convert_variables_to_constants(sess, graph.as_graph_def(), [UPDATE, RNN_STATE_OUT])
+		sess.close()
+
+	make_parent_dir(path)
+	with open(path, 'wb') as f:
+		f.write(graph_def.SerializeToString())
+
+
+class FrozenOptimizer(OptimizerBase):
+	"""
+	An optimizer loaded from a graph written by export_frozen_optimizer. It can be used in place
+	of an Optimizer to optimize other nets, through calc_update, fused_train_step, 
+	sharded_train_step and update_params. It has no variables so there is nothing to restore.
+	"""
+
+	def __init__(self, path=frozen_path):
+		self.graph_def = tf.GraphDef()
+		with open(path, 'rb') as f:
+			self.graph_def.ParseFromString(f.read())
+
+		rnn_state = [node for node in self.graph_def.node if node.name == RNN_STATE][0]
+		self.state_size = rnn_state.attr['shape'].shape.dim[1].size
+
+	def calc_update(self, grads, rnn_state):
+		""" Imports a copy of the frozen graph which takes grads and rnn_state as its inputs """
+		update, rnn_state_out = tf.import_graph_def(self.graph_def,
+										input_map={GRADS + ':0': grads, RNN_STATE + ':0': rnn_state},
+										return_elements=[UPDATE + ':0', RNN_STATE_OUT + ':0'],
+										name='opt_net')
+		return update, rnn_state_out
+
+
+def add_optimizer_arguments(parser):
+	""" Arguments of the scripts which apply the saved or a frozen optimizer to other nets, see load_optimizer """
+	parser.add_argument('--trace-steps', dest='trace_steps', type=int, nargs='+', default=[], help='Steps of each optimizer to write Chrome traces of')
+	parser.add_argument('--trace-dir', dest='trace_dir', default=trace_dir)
+	parser.add_argument('--shards', dest='num_shards', type=int, default=1, help='Apply the optimizer to this many shards of the parameters in parallel')
+	parser.add_argument('--streaming', dest='streaming', action='store_true', help='Apply the optimizer in chunks with its state in a file')
+	parser.add_argument('--frozen', dest='frozen_path', default=None, help='Use an optimizer exported by inference.py instead of the saved model')
+	parser.add_argument('--weights', dest='weight_mode', choices=weight_modes, default=inference_weight_mode, help='Weights of the optimizer\'s cells, see rnn_cell.weight_mode')
+
+
+def load_optimizer(parser, args, model_path=save_path):
+	"""
+	Returns a session and the optimizer chosen by the arguments of add_optimizer_arguments, 
+	either frozen or restored from model_path. Only the parts of the optimizer which are 
+	applied to other nets are built.
+	"""
+	if args.frozen_path is not None and args.weight_mode != inference_weight_mode:
+		parser.error('The weights of a frozen optimizer are chosen when it is exported, see inference.py --weights')
+		
+	# The shards are independent branches of the graph, run by the inter-op threads
+	sess = tf.Session(config=tf.ConfigProto(inter_op_parallelism_threads=args.num_shards) if args.num_shards > 1 else None)
+	
+	if args.frozen_path is not None:
+		opt_net = FrozenOptimizer(args.frozen_path)
+	else:
+		opt_net = Optimizer(training=False, weight_mode=args.weight_mode)
+		tf.train.Saver(tf.trainable_variables()).restore(sess, model_path)
+		sess.run(opt_net.refresh_weights) # Cache the weights of the cell, unless they are sampled
+		
+	return sess, opt_net
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--model', dest='model_path', default=save_path)
+	parser.add_argument('--output', dest='path', default=frozen_path)
+	parser.add_argument('--weights', dest='weight_mode', choices=weight_modes, default=inference_weight_mode, help='Weights of the optimizer\'s cells, see rnn_cell.weight_mode')
+	args = parser.parse_args()
+
+	export_frozen_optimizer(args.model_path, args.path, args.weight_mode)
+	print "Frozen optimizer written to %s" % args.path
@@ -26,6 +26,7 @@ import numpy as np
 import tensorflow as tf
 
 import ptb_reader as reader
+from optimizer import ParamLayout
 
 
 class LM(object):
@@ -35,7 +36,6 @@ class LM(object):
 		self.opt_net = opt_net
 		self.batch_size = 1 ### 32
 		self.batches = 1000
-		###self.num_params = 
 	
 		self.batch_size = batch_size = config.batch_size ### Must be 1 - alter it in SmallConfig
 		self.num_steps = num_steps = config.num_steps
@@ -96,18 +96,21 @@ class LM(object):
 		self.adam_train_step = adam_optimizer.apply_gradients(grad_var_pairs)
 		
 		#===# Opt net #===#
-		grads,_ = zip(*grad_var_pairs)
-		grads = [tf.reshape(i,(-1,1)) for i in grads]
+		grads,vars = zip(*grad_var_pairs)
+		
+		# Offsets of the variables in the flat vectors of gradients and updates
+		self.layout = ParamLayout(vars)
+		self.num_params = self.layout.size
 		
 		#grad_clip_value = None
 		#if not grad_clip_value is None:
 		#	grads = [tf.clip_by_value(g, -grad_clip_value, grad_clip_value) for g in grads]
 			
-		self.grads = tf.concat(0,grads)
+		self.grads = self.layout.flatten(grads)
 		self.trainable_variables = [i for i in tf.trainable_variables() if 'mnist/' in i.name]		
 
 		self.update = tf.placeholder(tf.float32,[self.num_params,1], 'update')
-		self.opt_net_train_step = self.opt_net.update_params(self.trainable_variables, self.update)
+		self.opt_net_train_step = self.opt_net.update_params(self.layout, self.update)
 		
 		vars = [i for i in tf.all_variables() if not 'optimizer' in i.name]
 		self.init = tf.initialize_variables(vars)
@@ -1,18 +1,28 @@
 from __future__ import division
 import argparse
-import random
+import os
+import subprocess
+import sys
+from multiprocessing.pool import ThreadPool
 
 import tensorflow as tf
-from tensorflow.examples.tutorials.mnist import input_data
 
 import numpy as np
 
-from constants import num_iterations, seq_length, save_path, summary_freq, \
-    episode_length, replay_mem_start_size, replay_memory_max_size, \
-	num_SNFs, num_rnn_layers, rnn_size, m, batch_size
-from snf import SNF, State, StateOps
+from constants import num_iterations, seq_length, summary_freq, summaries_dir, trace_dir, checkpoint_path, checkpoint_freq, \
+	candidate_dir, eval_freq, \
+    replay_mem_start_size, replay_memory_max_size, \
+	num_SNFs, num_rnn_layers, rnn_size, m, batch_size, snf_path, snf_seed, weight_sync_freq, \
+	accumulation_steps
+from snf import SNFBank, gen_snfs, save_snfs, load_snfs
+from replay_memory import create_replay_memory
+from actors import ActorPool, WeightSync, rollout, threaded_rollout, prefetched_rollout
+from prefetch import Prefetcher
+from checkpoint import save_checkpoint, load_checkpoint, checkpoint_snf_path
 from optimizer import Optimizer
-from mlp import MLP
+from profiling import PhaseTimer, Tracer
+from nn_utils import make_dir
+import evaluator
 
 """
 rm nohup.out; nohup python -u main.py -s &
@@ -24,169 +34,195 @@ pylint --rcfile=pylint.cfg main.py compare.py optimizer.py constants.py snf.py n
 def main():
 	parser = argparse.ArgumentParser()
 	parser.add_argument('--save', '-s', dest='save_model', action='store_true')
+	parser.add_argument('--snfs', dest='snf_path', default=snf_path)
+	parser.add_argument('--actors', dest='num_actors', type=int, default=0, help='Number of rollout processes, 0 runs rollouts in this process')
+	parser.add_argument('--threads', dest='num_threads', type=int, default=0, help='Number of unroll runs to keep in flight in this process')
+	parser.add_argument('--prefetch', dest='prefetch', action='store_true', help='Sample batches in a background thread')
+	parser.add_argument('--seed', dest='seed', type=int, default=None)
+	parser.add_argument('--checkpoint', dest='checkpoint_path', default=checkpoint_path)
+	parser.add_argument('--resume', dest='resume', action='store_true', help='Continue from the training state saved at --checkpoint')
+	parser.add_argument('--profile', dest='profile', action='store_true', help='Record the time spent in each phase of the training loop')
+	parser.add_argument('--trace-steps', dest='trace_steps', type=int, nargs='+', default=[], help='Iterations to write Chrome traces of')
+	parser.add_argument('--trace-dir', dest='trace_dir', default=trace_dir)
 	parser.set_defaults(save=False)
 	args = parser.parse_args()
+	
+	# The micro-batches are only accumulated when the rollouts run in this thread
+	if accumulation_steps > 1 and (args.num_actors > 0 or args.num_threads > 0):
+		parser.error("accumulation_steps > 1 in constants.py is not supported with --actors or --threads")
+	if batch_size % accumulation_steps != 0:
+		parser.error("batch_size must be divisible by accumulation_steps in constants.py")
+	if args.num_actors > 0 and args.num_threads > 0:
+		parser.error("--actors and --threads cannot be combined")
+	if args.prefetch and (args.num_actors > 0 or args.num_threads > 0):
+		parser.error("--prefetch is not supported with --actors or --threads")
 
 	if args.save_model:
 		print "Model will be saved"
 	else:
 		print "Model will not be saved"
 		
+	# Candidate models are evaluated on MNIST by a separate process so training never waits for it
+	if args.save_model:
+		make_dir(candidate_dir)
+		if args.resume:
+			stop_path = os.path.join(candidate_dir, evaluator.STOP_FILENAME)
+			if os.path.exists(stop_path):
+				os.remove(stop_path)
+		else:
+			evaluator.clear_candidates(candidate_dir)
+			
+		evaluator_args = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'evaluator.py'), 
+							'--candidates', candidate_dir, '--trainer-pid', str(os.getpid())]
+		if args.resume:
+			evaluator_args.append('--resume')
+		evaluator_process = subprocess.Popen(evaluator_args)
+		
+	if args.seed is not None:
+		np.random.seed(args.seed)
+		tf.set_random_seed(args.seed)
+		
+	# A resumed run must use the SNFs its replay memory refers to
+	if args.resume:
+		args.snf_path = checkpoint_snf_path(args.checkpoint_path)
+		
+	# The set of SNFs is generated once and then reused by every run
+	if os.path.exists(args.snf_path):
+		print "Loading SNFs..."
+		snfs = load_snfs(args.snf_path)
+	else:
+		print "Generating SNFs..."
+		snfs = gen_snfs(num_SNFs, snf_seed)
+		save_snfs(args.snf_path, snfs)
+		
+	# Started before the session is created, the actors load the SNFs from the same file
+	actor_pool = None
+	if args.num_actors > 0:
+		print "Starting %d actors..." % args.num_actors
+		actor_pool = ActorPool(args.num_actors, batch_size, args.snf_path, args.seed)
+		
 	sess = tf.Session()
-	state_ops = StateOps()
 	
-	opt_net = Optimizer()
+	replay_memory = None # Each actor has its own
+	if actor_pool is None:
+		print "Initializing replay memory..."
+		replay_memory = create_replay_memory(replay_memory_max_size, replay_mem_start_size, len(snfs))
+		print "Replay memory: {} bytes per entry, {:.1f} MB in total".format(replay_memory.nbytes_per_entry(), replay_memory.nbytes()/1e6)
+		
+	# sess.run releases the GIL so several unrolls can run at once
+	thread_pool = None
+	if args.num_threads > 0:
+		thread_pool = ThreadPool(args.num_threads)
+		
+	# The micro-batches are sampled in the background and dequeued by the Optimizer
+	prefetcher = None
+	if args.prefetch:
+		prefetcher = Prefetcher(replay_memory, batch_size//accumulation_steps)
+	
+	# Stored in the graph once rather than being fed on every run
+	snf_bank = SNFBank(snfs)
 	
-	mnist = input_data.read_data_sets("MNIST_data/", one_hot=True)
-	net = MLP(opt_net)
+	if prefetcher is None:
+		opt_net = Optimizer(snf_bank)
+	else:
+		opt_net = Optimizer(snf_bank, prefetcher.inputs())
 	
-	snfs = []
-	# Generate the set of SNFs
-	print "Generating SNFs..."
-	for i in range(num_SNFs):
-		snf = SNF()
-		snfs.append(snf)
+	if actor_pool is not None:
+		weight_sync = WeightSync()
 	
-	print "Initializing replay memory..."
-	replay_memory = []
+	# Built once, saving does not add ops to the graph
+	candidate_saver = tf.train.Saver(tf.trainable_variables(), max_to_keep=5)
+	checkpoint_saver = tf.train.Saver(tf.all_variables(), max_to_keep=1)
 	
-	# Add some initial states to the replay memory
-	for i in range(replay_mem_start_size):
-		snf = random.choice(snfs)
-
-		# Initializer computes a random point and the SNF loss
-		state = State(snf, state_ops, sess)
-		replay_memory.append(state)
+	# Written to TensorBoard and to a CSV file every summary_freq iterations
+	timer = PhaseTimer(args.profile, os.path.join(summaries_dir, 'timing'), os.path.join(summaries_dir, 'timing.csv'))
+	tracer = Tracer(args.trace_steps, args.trace_dir)
 	
 	init = tf.initialize_all_variables()
 	sess.run(init)
 	
 	best_loss = np.float('inf')
 	best_accuracy = 0
+	start_iteration = 0
+	
+	if args.resume:
+		print "Resuming from %s..." % args.checkpoint_path
+		iteration, best_accuracy = load_checkpoint(sess, checkpoint_saver, args.checkpoint_path, replay_memory)
+		start_iteration = iteration + 1
+	
+	if actor_pool is not None:
+		actor_pool.broadcast(weight_sync.get(sess))
+		
+	if prefetcher is not None:
+		prefetcher.start(sess)
 
 	# Training loop
-	for i in range(num_iterations):
-		batch_losses = []
-		batch_loss_change_sign = []
-		batch_grads = []
-		batch_counters = []
+	for i in range(start_iteration, num_iterations):
+		#===# Train the optimizer #===#	
+		# Traces the runs of this iteration if it was selected, saving is not traced
+		run_sess = tracer.session(sess, i)
 		
-		for j in range(batch_size):
-			# Retrieve a random starting point from the replay memory
-			state = random.choice(replay_memory)
-			snf = state.snf
-			
-			if state.counter >= episode_length:
-				snf = random.choice(snfs)
-				state = State(snf, state_ops, sess)
-				
-			batch_counters.append(state.counter)
-			prev_counter = state.counter
-				
-			# The RNN state is initially zero but this will become
-			# rarer as old states are put back into the replay memory
-			
-			feed_dict = {opt_net.point: state.point,
-							opt_net.variances: snf.variances, 
-							opt_net.weights: snf.weights, 
-							opt_net.hyperplanes: snf.hyperplanes,
-							opt_net.initial_rnn_state: state.rnn_state}
-			
-			res = sess.run([opt_net.new_point,
-							opt_net.rnn_state_out,
-							opt_net.loss_change_sign,
-							opt_net.total_loss]
-							+ [g for g,v in opt_net.gvs], 
-							feed_dict=feed_dict)
-														
-			new_point, rnn_state_out, loss_change_sign, loss = res[0:4]
-			grads_out = res[4:]
-			
-			# Prepare a new state to add to the replay memory
-			state = State(snf, state_ops, sess)
-			state.point = new_point
-			state.rnn_state = rnn_state_out
-			state.counter = prev_counter + seq_length
-
-			# Prevent these attributes from being used until their values are overridden
-			state.loss = None
-			state.grads = None
-				
-			# Only the last state is added. Adding more may result in a loss 
-			# of diversity in the replay memory
-			replay_memory.append(state)
-			
-			if len(replay_memory) > replay_memory_max_size:
-				replay_memory = replay_memory[-replay_memory_max_size:]
+		if actor_pool is None and thread_pool is None:
+			# The batch is unrolled in micro-batches whose gradients are summed in the graph
+			if prefetcher is None:
+				results = [rollout(run_sess, opt_net, replay_memory, batch_size//accumulation_steps, accumulate=True, timer=timer) 
+							for j in range(accumulation_steps)]
+			else:
+				results = [prefetched_rollout(run_sess, opt_net, prefetcher, accumulate=True, timer=timer) for j in range(accumulation_steps)]
+			loss, avg_loss_change_sign, avg_counter = np.mean([res[0:3] for res in results], axis=0)
 			
-			batch_losses.append(loss)
-			batch_loss_change_sign.append(loss_change_sign)
-			batch_grads.append(grads_out)
-		
-		loss = np.mean(batch_losses)
-		avg_loss_change_sign = np.mean(batch_loss_change_sign)
-		avg_counter = np.mean(batch_counters)
-
-		total_grads = batch_grads[0]
-		
-		for j in range(1,batch_size):
-			for k in range(len(batch_grads[j])):
-				total_grads[k] += batch_grads[j][k]
-		
-		total_grads = [j/batch_size for j in total_grads]
+			with timer.phase('train_step'):
+				_ = run_sess.run([opt_net.apply_and_reset])
+		else:
+			if actor_pool is not None:
+				# Includes waiting for the actors to finish their unrolls
+				with timer.phase('unroll'):
+					loss, avg_loss_change_sign, avg_counter, total_grads = actor_pool.collect()
+			else:
+				loss, avg_loss_change_sign, avg_counter, total_grads = threaded_rollout(run_sess, opt_net, replay_memory, 
+																		batch_size, thread_pool, args.num_threads, timer)
 		
-		#===# Train the optimizer #===#	
-		# By the derivative sum rule, the average of the derivatives (calculated here)
-		# is identical to the derivative of the average (the usual method).
-		feed_dict = {}
-		for j in range(len(opt_net.grads_input)):
-			feed_dict[opt_net.grads_input[j][0]] = total_grads[j]
+			# total_grads are the gradients of the loss averaged over the batch
+			feed_dict = {}
+			for j in range(len(opt_net.grads_input)):
+				feed_dict[opt_net.grads_input[j][0]] = total_grads[j]
+			
+			with timer.phase('train_step'):
+				_ = run_sess.run([opt_net.train_step], feed_dict=feed_dict)
+		timer.count(batch_size, batch_size*seq_length)
 		
-		_ = sess.run([opt_net.train_step], feed_dict=feed_dict)
+		if actor_pool is not None and (i + 1) % weight_sync_freq == 0:
+			actor_pool.broadcast(weight_sync.get(sess))
 			
 		if i % summary_freq == 0 and i > 0:
 			print "{:>3}{:>10.3}{:>10.3}{:>10.3}".format(i, loss, avg_loss_change_sign, avg_counter)
+			if args.profile:
+				samples_per_sec, unroll_steps_per_sec = timer.flush(i)
+				print "{:>3}{:>10.1f} samples/s{:>10.1f} unroll steps/s".format(i, samples_per_sec, unroll_steps_per_sec)
 			
-		# Save model
-		if args.save_model:
-			accuracies = []
-			
-			for k in range(1):
-				# Evaluate on the MNIST MLP			
-				sess.run(net.init) # Reset parameters of the net to be trained
-				rnn_state = np.zeros([net.num_params, net.opt_net.cell.state_size])
-			
-				for j in range(net.batches):
-					batch_x, batch_y = mnist.train.next_batch(net.batch_size)
-					
-					# Compute gradients
-					grads = sess.run(net.grads, feed_dict={net.x:batch_x, net.y_:batch_y})
-					
-					# Compute update
-					feed_dict = {net.opt_net.input_grads: np.reshape(grads,[1,-1,1]), 
-								net.opt_net.initial_rnn_state: rnn_state}
-					[update, rnn_state] = sess.run([net.opt_net.update, net.opt_net.rnn_state_out_compare], feed_dict=feed_dict)
-		
-					# Update MLP parameters
-					_ = sess.run([net.opt_net_train_step], feed_dict={net.update:update})
-					
-				accuracy = sess.run(net.accuracy, feed_dict={net.x: mnist.test.images, net.y_: mnist.test.labels})
-				accuracies.append(accuracy)
+		# Save a candidate model for the evaluator
+		if args.save_model and ((i + 1) % eval_freq == 0 or i == num_iterations - 1):
+			with timer.phase('save'):
+				candidate_saver.save(sess, evaluator.candidate_path(candidate_dir), global_step=i, 
+										latest_filename=evaluator.LATEST_FILENAME)
+			best_accuracy = max(best_accuracy, evaluator.read_best_accuracy())
+			print "{:>3}{:>10.3}{:>10.3}{:>10.3}{:>10.3} (best)".format(i, loss, avg_loss_change_sign, avg_counter, best_accuracy)
 				
-			a = np.mean(accuracies)
-			
-			if a > best_accuracy:
-				best_accuracy = a
-				#best_loss = loss
-
-				saver = tf.train.Saver(tf.trainable_variables())
-				saver.save(sess, save_path)
-				print "{:>3}{:>10.3}{:>10.3}{:>10.3}{:>10.3} (S)".format(i, loss, avg_loss_change_sign, avg_counter, a)
+		if (i + 1) % checkpoint_freq == 0 or i == num_iterations - 1:
+			with timer.phase('save'):
+				save_checkpoint(sess, checkpoint_saver, args.checkpoint_path, i, best_accuracy, args.snf_path, replay_memory)
 				
-			else:
-				print "{:>3}{:>10.3}{:>10.3}{:>10.3}{:>10.3}".format(i, loss, avg_loss_change_sign, avg_counter, a)
+	if actor_pool is not None:
+		actor_pool.stop()
+	if args.save_model:
+		# Wait for the last candidate to be evaluated
+		evaluator.request_stop(candidate_dir)
+		evaluator_process.wait()
+	if thread_pool is not None:
+		thread_pool.close()
+	if prefetcher is not None:
+		prefetcher.stop(sess)
+	timer.close()
 
 if __name__ == "__main__":
 	main()
-	
-	
\ No newline at end of file
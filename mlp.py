@@ -2,13 +2,15 @@ from __future__ import division
 
 import tensorflow as tf
 from constants import rnn_size, m
+from nn_utils import cross_entropy
+from optimizer import ParamLayout
+from streaming import StreamingOptimizer
 
 class MLP:
-	def __init__(self, opt_net):
+	def __init__(self, opt_net, num_shards=1, streaming=False):
 		self.opt_net = opt_net
 		self.batch_size = 64
 		self.batches = 1000
-		self.num_params = 7850
 
 		# Define architecture
 		self.x = tf.placeholder(tf.float32, [None, 784], 'x')
@@ -19,45 +21,58 @@ class MLP:
 			self.W = tf.Variable(tf.truncated_normal(stddev=0.1, shape=[784,10]))
 			self.b = tf.Variable(tf.constant(0.1, shape=[10]))
 			
-		y = tf.nn.softmax(tf.matmul(self.x,self.W) + self.b)
-		y = tf.clip_by_value(y, 1e-10, 1.0) # Prevent log(0) in the cross-entropy calculation
+		y = self.forward(self.x)
 		
 		correct_prediction = tf.equal(tf.argmax(y,1), tf.argmax(self.y_,1))
 		self.accuracy = tf.reduce_mean(tf.cast(correct_prediction, tf.float32))
 
-		self.loss = tf.reduce_mean(-tf.reduce_sum(self.y_ * tf.log(y), reduction_indices=[1])) # Cross-entropy
+		self.loss = cross_entropy(y, self.y_)
 		tf.scalar_summary('loss', self.loss)
 
-		sgd_optimizer = tf.train.GradientDescentOptimizer(0.1)
-		rmsprop_optimizer = tf.train.RMSPropOptimizer(0.001)
-		adam_optimizer = tf.train.AdamOptimizer()
+		# Kept so their slots can be reused by training_loop
+		self.sgd_optimizer = tf.train.GradientDescentOptimizer(0.1)
+		self.rmsprop_optimizer = tf.train.RMSPropOptimizer(0.001)
+		self.adam_optimizer = tf.train.AdamOptimizer()
 		
-		grad_var_pairs = sgd_optimizer.compute_gradients(self.loss)
+		grad_var_pairs = self.sgd_optimizer.compute_gradients(self.loss)
 		grad_var_pairs = [i for i in grad_var_pairs if 'mnist/' in i[1].name]
 		
-		self.sgd_train_step = sgd_optimizer.apply_gradients(grad_var_pairs)
-		self.rmsprop_train_step = rmsprop_optimizer.apply_gradients(grad_var_pairs)
-		self.adam_train_step = adam_optimizer.apply_gradients(grad_var_pairs)
+		self.sgd_train_step = self.sgd_optimizer.apply_gradients(grad_var_pairs)
+		self.rmsprop_train_step = self.rmsprop_optimizer.apply_gradients(grad_var_pairs)
+		self.adam_train_step = self.adam_optimizer.apply_gradients(grad_var_pairs)
 	
 		#===# Opt net #===#
-		grads,_ = zip(*grad_var_pairs)
-		grads = [tf.reshape(i,(-1,1)) for i in grads]
+		grads,vars = zip(*grad_var_pairs)
+		
+		# Offsets of the variables in the flat vectors of gradients and updates
+		self.layout = ParamLayout(vars)
+		self.num_params = self.layout.size
 		
 		#grad_clip_value = None
 		#if not grad_clip_value is None:
 		#	grads = [tf.clip_by_value(g, -grad_clip_value, grad_clip_value) for g in grads]
 			
-		self.grads = tf.concat(0,grads)
+		self.grads = self.layout.flatten(grads)
 		self.trainable_variables = [i for i in tf.trainable_variables() if 'mnist/' in i.name]		
 
-		self.update = tf.placeholder(tf.float32,[self.num_params,1], 'update')
-		self.opt_net_train_step = self.opt_net.update_params(self.trainable_variables, self.update)
+		if streaming:
+			# Applied in chunks by streaming_optimizer.step, the states are kept in a file
+			self.streaming_optimizer = StreamingOptimizer(self.opt_net, self.layout, self.grads)
+		elif num_shards > 1:
+			# Shards of the parameters are updated in parallel, each with its own state
+			self.opt_net_train_step, self.opt_net_states = self.opt_net.sharded_train_step(self.grads, self.layout, num_shards)
+		else:
+			# The RNN state of each parameter stays in the graph between steps
+			self.opt_net_state = tf.Variable(tf.zeros([self.num_params, self.opt_net.state_size]), trainable=False, name='opt_net_state')
+			self.opt_net_train_step = self.opt_net.fused_train_step(self.grads, self.opt_net_state, self.layout)
 		
 		vars = [i for i in tf.all_variables() if not 'optimizer' in i.name]
 		self.init = tf.initialize_variables(vars)
 		
 		#===# Model training #===#
 		
+	def forward(self, x):
+		""" Predicted class probabilities for the images x """
+		y = tf.nn.softmax(tf.matmul(x,self.W) + self.b)
+		return tf.clip_by_value(y, 1e-10, 1.0) # Prevent log(0) in the cross-entropy calculation
 		
-		
-		
\ No newline at end of file
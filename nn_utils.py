@@ -1,4 +1,5 @@
 from __future__ import division
+import os
 
 import numpy as np
 import tensorflow as tf
@@ -65,6 +66,13 @@ def scale_grads(x):
 		return tf.sign(x)*tf.log(tf.maximum(tf.abs(x + tf.sign(x)),1e-2))
 	return x
 	
+	
+def np_scale_grads(x):
+	if grad_scaling_method == 'full':
+		# Operations are element-wise
+		return np.sign(x)*np.log(np.maximum(np.abs(x + np.sign(x)),1e-2))
+	return x
+	
 
 def inv_scale_grads(x):
 	if grad_scaling_method == 'full':	
@@ -92,6 +100,22 @@ def np_inv_scale_grads(x):
 	return x
 	
 
+def cross_entropy(y, y_):
+	""" Mean cross-entropy of the predicted probabilities y and the one-hot labels y_ """
+	return tf.reduce_mean(-tf.reduce_sum(y_ * tf.log(y), reduction_indices=[1]))
+	
+
+def make_dir(dir_name):
+	""" Creates dir_name and its parents if they do not exist """
+	if dir_name and not os.path.exists(dir_name):
+		os.makedirs(dir_name)
+		
+		
+def make_parent_dir(path):
+	""" Creates the directory the file path is in if it does not exist """
+	make_dir(os.path.dirname(path))
+	
+
 def tf_print(x):
 	x = tf.Print(x,[x])
 	return
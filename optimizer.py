@@ -6,97 +6,200 @@ import numpy as np
 import rnn
 import rnn_cell
 from nn_utils import weight_matrix, bias_vector, fc_layer, fc_layer3, inv_scale_grads
-from constants import rnn_size, num_rnn_layers, k, m, rnn_type, grad_scaling_method, \
+from constants import rnn_size, num_rnn_layers, k, m, rnn_type, grad_scaling_method, inference_weight_mode, \
 		episode_length, loss_noise, loss_asymmetry, seq_length
 import snf
 from nn_utils import tf_print
 
 
-class Optimizer(object):
+class OptimizerBase(object):
+	"""
+	Applies an optimizer to the variables of other nets. Subclasses set state_size, the size of 
+	the RNN state of a coordinate, and implement calc_update.
+	"""
+	
+	def calc_update(self, grads, rnn_state):
+		""" Returns the update [num_params,1] for the gradients grads [num_params,1] and the new RNN state """
+		raise NotImplementedError
+		
+	def fused_train_step(self, grads, rnn_state, layout):
+		"""
+		Returns an op which computes the update of the variables of layout, a ParamLayout, from 
+		their gradients grads [num_params,1] and applies it. The new RNN state of each coordinate 
+		is stored in the variable rnn_state [num_params,state_size], so a step of the optimized 
+		net is a single run without host copies.
+		"""
+		update, rnn_state_out = self.calc_update(grads, rnn_state)
+				
+		# Both assignments depend on the update so they run after the gradients and state are read
+		return tf.group(self.update_params(layout, update), rnn_state.assign(rnn_state_out))
+			
+			
+	def sharded_train_step(self, grads, layout, num_shards):
+		"""
+		Same as fused_train_step, but the coordinates are split into num_shards contiguous shards 
+		(see ParamLayout.shards) which are independent branches of the graph, so the session's 
+		inter-op threads run them in parallel. Each shard has its own RNN state and adds its update directly to 
+		the rows of the variables it covers. Returns the op and the RNN states of the shards.
+		"""
+		ops = []
+		rnn_states = []
+		
+		for chunk in layout.shards(num_shards):
+			offset, size = layout.chunk_range(chunk)
+			rnn_state = tf.Variable(tf.zeros([size, self.state_size]), trainable=False, name='opt_net_state_shard')
+			update, rnn_state_out = self.calc_update(tf.slice(grads, [offset,0], [size,1]), rnn_state)
+			
+			ops += [layout.scatter_add_chunk(chunk, update), rnn_state.assign(rnn_state_out)]
+			rnn_states.append(rnn_state)
+			
+		return tf.group(*ops), rnn_states
+		
+	# Update the parameters of another network (eg an MLP)
+	def update_params(self, layout, update):
+		return layout.scatter_add(update)
+		
+		
+class Optimizer(OptimizerBase):
 
-	def __init__(self):
+	def __init__(self, snf_bank=None, inputs=None, training=True, weight_mode=inference_weight_mode):
+		"""
+		snf_bank: SNFBank the SNFs are gathered from by index. If None their parameters are fed.
+		inputs: Optional dict of tensors used in place of the point, snf_index, rnn_states and 
+			sample_weights placeholders, eg batches dequeued by a Prefetcher. Requires snf_bank.
+		training: If False only the cell and output layer are built, with the same variable 
+			names, for restoring a saved model to optimize other nets with.
+		weight_mode: rnn_cell.weight_mode of the cell when it optimizes other nets. Training 
+			always samples the weights. Run refresh_weights after restoring a model.
+		"""
+		self.weight_mode = weight_mode
+		
+		if rnn_type == 'lstm':
+			state_size = 2*num_rnn_layers*rnn_size
+		else:
+			state_size = num_rnn_layers*rnn_size
+		self.state_size = state_size
+			
+		# initial_rnn_state is passed during evaluation but not during training
+		# each dimension has an independent hidden state, required in order to simulate Adam, RMSProp etc.
+		self.initial_rnn_state = tf.placeholder_with_default(input=tf.zeros([m, state_size]), shape=[None, state_size])
+		
+		if not training:
+			with tf.variable_scope("optimizer"):
+				self.cell = self._create_cell()
+				self._build_comparison(reuse=False)
+			self.refresh_weights = rnn_cell.refresh_weights()
+			return
+		
 		# Input
-		self.point = tf.placeholder(tf.float32, [m,1], 'points') # Used in training only
-		self.variances = tf.placeholder(tf.float32, [k,1], 'variances')
-		self.weights = tf.placeholder(tf.float32, [k,1], 'weights')
-		self.hyperplanes = tf.placeholder(tf.float32, [m,m,k], 'hyperplanes') # Points which define the hyperplanes
+		# Each point in the batch is on its own SNF and has its own RNN state
+		if inputs is not None:
+			self.point = inputs['point']
+		else:
+			self.point = tf.placeholder(tf.float32, [None,m,1], 'points') # Used in training only
+		
+		if snf_bank is None:
+			self.variances = tf.placeholder(tf.float32, [None,k,1], 'variances')
+			self.weights = tf.placeholder(tf.float32, [None,k,1], 'weights')
+			self.normals = tf.placeholder(tf.float32, [None,k,m], 'normals') # Unit normals of the hyperplanes
+			self.offsets = tf.placeholder(tf.float32, [None,k,1], 'offsets') # Distances of the hyperplanes from the origin
+		else:
+			# The SNF parameters are already stored in the graph so only their indices are fed
+			if inputs is not None:
+				self.snf_index = inputs['snf_index']
+			else:
+				self.snf_index = tf.placeholder(tf.int32, [None], 'snf_index')
+			self.normals, self.offsets, self.variances, self.weights = snf_bank.gather(self.snf_index)
 			
-		if rnn_type == 'lstm':
-			self.initial_rnn_state = tf.placeholder_with_default(input=tf.zeros([m, 2*num_rnn_layers*rnn_size]), shape=[None, 2*num_rnn_layers*rnn_size])
+		# The RNN state of each point in the batch, stored in the replay memory with the point.
+		# The unroll itself starts from a zero state.
+		if inputs is not None:
+			self.rnn_states = inputs['rnn_states']
 		else:
-			# initial_rnn_state is passed during evaluation but not during training
-			# each dimension has an independent hidden state, required in order to simulate Adam, RMSProp etc.
-			self.initial_rnn_state = tf.placeholder_with_default(input=tf.zeros([m, num_rnn_layers*rnn_size]), shape=[None, num_rnn_layers*rnn_size])
+			self.rnn_states = tf.placeholder(tf.float32, [None,m,state_size], 'rnn_states')
 
 		# The scope allows these variables to be excluded from being reinitialized during the comparison phase
 		with tf.variable_scope("optimizer"):
-			if rnn_type == 'rnn':
-				cell = rnn_cell.BasicRNNCell(rnn_size)
-			elif rnn_type == 'gru':
-				cell = rnn_cell.GRUCell(rnn_size)
-			elif rnn_type == 'lstm':
-				cell = rnn_cell.LSTMCell(rnn_size)
-				
-			self.cell = rnn_cell.MultiRNNCell([cell] * num_rnn_layers)
+			self.cell = self._create_cell()
+			
+			# Creates the variables outside of the while loop so each point can be given its own copy
+			self._build_comparison(reuse=False)
+			vars = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=tf.get_variable_scope().name)
+			
+			# Zero offsets added to the variables, the gradient of the loss of each point with 
+			# respect to them is the gradient of that point alone
+			num_points = tf.shape(self.point)[0]
+			point_offsets = [tf.zeros(tf.concat(0, [tf.expand_dims(num_points,0), v.get_shape().as_list()])) for v in vars]
+			for offset,v in zip(point_offsets,vars):
+				offset.set_shape([None] + v.get_shape().as_list())
+			self.per_point_offsets = dict((v.name,offset) for v,offset in zip(vars,point_offsets))
 			
-			updates = []
-			snf_losses = []
+			# The U(-1,1) draws of the noisy weight matrices of each point at each step. They are 
+			# drawn in the graph unless they are fed, see weight_noise_feed.
+			self.weight_noise = {}
+			for v in vars:
+				if v.name.endswith('/W_m:0'):
+					shape = v.get_shape().as_list()
+					draws = tf.random_uniform(tf.concat(0, [[seq_length], tf.expand_dims(num_points,0), shape]), -1.0, 1.0)
+					self.weight_noise[v.name] = tf.placeholder_with_default(draws, [seq_length,None] + shape)
 			
 			# Arguments passed to the condition and body functions
 			time = tf.constant(0)
 			point = self.point
 			
-			snf_loss = snf.calc_snf_loss_tf(point, self.hyperplanes, self.variances, self.weights)
-			snf_losses.append(snf_loss)
-			snf_grads = snf.calc_grads_tf(snf_loss,point)
-			snf_grads = tf.squeeze(snf_grads, [0])
+			snf_losses = snf.calc_snf_losses_tf(point, self.normals, self.offsets, self.variances, self.weights)
+			snf_grads = snf.calc_batch_grads_tf(snf_losses,point)
+			snf_grads = tf.reshape(snf_grads, [-1,m,1])
 			
 			snf_loss_ta = tf.TensorArray(dtype=tf.float32, size=seq_length)
 			update_ta = tf.TensorArray(dtype=tf.float32, size=seq_length)
-			rnn_state = tf.zeros([m,rnn_size*num_rnn_layers])
+			rnn_state = tf.zeros(tf.pack([num_points, m, state_size]))
+			rnn_state.set_shape([None, m, state_size])
 			
-			loop_vars = [time, point, snf_grads, rnn_state, snf_loss_ta, update_ta, self.hyperplanes, self.variances, self.weights]
+			loop_vars = [time, point, snf_grads, rnn_state, snf_loss_ta, update_ta, self.normals, self.offsets, self.variances, self.weights]
 			
-			def condition(time, point, snf_grads, rnn_state, snf_loss_ta, update_ta, hyperplanes, variances, weights):
+			def condition(time, point, snf_grads, rnn_state, snf_loss_ta, update_ta, normals, offsets, variances, weights):
 				return tf.less(time,seq_length)
 				
-			def body(time, point, snf_grads, rnn_state, snf_loss_ta, update_ta, hyperplanes, variances, weights):
+			def body(time, point, snf_grads, rnn_state, snf_loss_ta, update_ta, normals, offsets, variances, weights):
 				
-				h, rnn_state_out = self.cell(snf_grads, rnn_state)
+				# Every coordinate of every point is a separate element of the RNN's batch
+				noise = dict((name, tf.gather(draws, time)) for name,draws in self.weight_noise.items())
+				with rnn_cell.per_sample_weights(self.per_point_offsets, noise):
+					h, rnn_state_out = self.cell(tf.reshape(snf_grads,[-1,1]), tf.reshape(rnn_state,[-1,state_size]))
+				rnn_state_out = tf.reshape(rnn_state_out, [-1,m,state_size])
 
 				# Final layer of the optimizer
 				# Cannot use fc_layer due to a 'must be from the same frame' error
-				d = np.sqrt(1.0)/np.sqrt(rnn_size+1) ### should be sqrt(2, 3 or 6?)
-				initializer = tf.random_uniform_initializer(-d, d)
-				W = tf.get_variable("W", [rnn_size,1], initializer=initializer)
+				W = self._get_output_weights()
+				W += self.per_point_offsets[W.name] # [n,rnn_size,1]
 				
 				# No bias, linear activation function
-				update = tf.matmul(h,W)
-				update = tf.reshape(update, [m,1])
+				update = tf.batch_matmul(tf.reshape(h,[-1,m,rnn_size]), W)
+				update = tf.reshape(update, [-1,m,1])
 				update = inv_scale_grads(update)
 				
 				new_point = point + update
 				
-				snf_loss = snf.calc_snf_loss_tf(new_point, hyperplanes, variances, weights)
-				snf_losses.append(snf_loss)
+				snf_losses = snf.calc_snf_losses_tf(new_point, normals, offsets, variances, weights) # [n]
 				
-				snf_loss_ta = snf_loss_ta.write(time, snf_loss)
+				snf_loss_ta = snf_loss_ta.write(time, snf_losses)
 				update_ta = update_ta.write(time, update)
 				
-				snf_grads_out = snf.calc_grads_tf(snf_loss,point)
-				snf_grads_out = tf.reshape(snf_grads_out,[m,1])
+				snf_grads_out = snf.calc_batch_grads_tf(snf_losses,point)
+				snf_grads_out = tf.reshape(snf_grads_out,[-1,m,1])
 				
 				time += 1
-				return [time, new_point, snf_grads_out, rnn_state_out, snf_loss_ta, update_ta, hyperplanes, variances, weights]		
+				return [time, new_point, snf_grads_out, rnn_state_out, snf_loss_ta, update_ta, normals, offsets, variances, weights]		
 			
 			# Do the computation
-			with tf.variable_scope("o1"):
+			with tf.variable_scope("o1", reuse=True):
 				res = tf.while_loop(condition, body, loop_vars)
 			
-			self.new_point = res[1]
-			self.rnn_state_out = res[3]		
-			losses = res[4].pack()
-			updates = res[5].pack()
+			self.new_point = res[1] # [n,m,1]
+			self.rnn_state_out = res[3] # [n,m,state_size]
+			losses = res[4].pack() # [seq_length,n]
+			updates = res[5].pack() # [seq_length,n,m,1]
 			
 			# Total change in the SNF loss
 			# Improvement: 2 - 3 = -1 (small loss)
@@ -105,58 +208,223 @@ class Optimizer(object):
 			self.loss_change_sign = tf.sign(snf_loss_change)
 			
 			# Oscillation cost
-			overall_update = tf.zeros([m,1])
-			norm_sum = 0.0
-				
-			for i in range(seq_length):
-				overall_update += updates[i,:,:]
-				norm_sum += tf_norm(updates[i,:,:])
+			overall_update = tf.reduce_sum(updates, reduction_indices=[0]) # [n,m,1]
+			norm_sum = tf.reduce_sum(tf_norm(updates, reduction_indices=[2,3]), reduction_indices=[0]) # [n]
 				
-			osc_cost = norm_sum/tf_norm(overall_update)	# > 1
+			osc_cost = norm_sum/tf_norm(overall_update, reduction_indices=[1,2]) # > 1
+			
+			self.total_losses = snf_loss_change*tf.pow(osc_cost,tf.sign(snf_loss_change)) # [n]
+			
+			# Importance weights of the points when sampled from a prioritized replay memory
+			if inputs is not None:
+				self.sample_weights = inputs['sample_weights']
+			else:
+				self.sample_weights = tf.placeholder_with_default(tf.ones_like(self.total_losses), [None], 'sample_weights')
 			
-			self.total_loss = snf_loss_change*tf.pow(osc_cost,tf.sign(snf_loss_change))
+			self.total_loss = tf.reduce_mean(self.sample_weights*self.total_losses)
 			
 			#===# Model training #===#
 			#opt = tf.train.RMSPropOptimizer(0.01,momentum=0.5)
 			opt = tf.train.AdamOptimizer()
-			vars = tf.trainable_variables()
 			
-			gvs = opt.compute_gradients(self.total_loss, vars)
+			# The gradients of each point are clipped before they are averaged over the batch
+			point_grads = tf.gradients(tf.reduce_sum(self.total_losses), point_offsets)
 			
-			self.gvs = [(tf.clip_by_value(grad, -1.0, 1.0), var) for (grad, var) in gvs]
+			self.gvs = []
+			for grad,var in zip(point_grads,vars):
+				if grad is None:
+					raise ValueError("The loss of each point has no gradient with respect to %s" % var.name)
+				sample_weights = tf.reshape(self.sample_weights, [-1] + [1]*len(var.get_shape()))
+				grad = tf.reduce_mean(sample_weights*tf.clip_by_value(grad, -1.0, 1.0), reduction_indices=[0])
+				self.gvs.append((grad, var))
 
-			self.grads_input = [(tf.placeholder(tf.float32, shape=v.get_shape()), v) for (g,v) in gvs]
+			self.grads_input = [(tf.placeholder(tf.float32, shape=v.get_shape()), v) for (g,v) in self.gvs]
 			self.train_step = opt.apply_gradients(self.grads_input)
 			
-			#===# Comparison code #===#
-			self.input_grads = tf.placeholder(tf.float32, [1,None,1], 'input_grads') ### Remove first dimension?
-			input_grads = tf.squeeze(self.input_grads, [0])
+			#===# Gradient accumulation #===#
+			# The gradients of several micro-batches are summed in the graph and their average is 
+			# applied by apply_and_reset, so they never have to be fetched
+			grad_sums = [tf.Variable(tf.zeros(v.get_shape()), trainable=False, name='grad_sum') for (g,v) in self.gvs]
+			num_grads = tf.Variable(0.0, trainable=False, name='num_grads')
+			
+			self.accumulate = tf.group(*([s.assign_add(g) for s,(g,v) in zip(grad_sums, self.gvs)] + [num_grads.assign_add(1.0)]))
+			
+			apply_step = opt.apply_gradients([(s/num_grads, v) for s,(g,v) in zip(grad_sums, self.gvs)])
+			with tf.control_dependencies([apply_step]):
+				self.apply_and_reset = tf.group(*([s.assign(tf.zeros_like(s)) for s in grad_sums] + [num_grads.assign(0.0)]))
+		self.refresh_weights = rnn_cell.refresh_weights()
+			
+	def weight_noise_feed(self, num_points, rng=np.random):
+		""" Draws the weight noise of an unroll of num_points points from rng, eg so concurrent runs are deterministic """
+		return dict((draws, rng.uniform(-1.0, 1.0, [seq_length,num_points] + draws.get_shape().as_list()[2:]).astype(np.float32)) 
+					for name,draws in sorted(self.weight_noise.items()))
 			
-			with tf.variable_scope("o1", reuse=True) as scope:
+	def _create_cell(self):
+		if rnn_type == 'rnn':
+			cell = rnn_cell.BasicRNNCell(rnn_size)
+		elif rnn_type == 'gru':
+			# Same variables as GRUCell, faster on the single-column input of each coordinate
+			cell = rnn_cell.FusedGRUCell(rnn_size)
+		elif rnn_type == 'lstm':
+			cell = rnn_cell.LSTMCell(rnn_size)
+			
+		return rnn_cell.MultiRNNCell([cell] * num_rnn_layers)
+		
+	def _get_output_weights(self):
+		d = np.sqrt(1.0)/np.sqrt(rnn_size+1) ### should be sqrt(2, 3 or 6?)
+		initializer = tf.random_uniform_initializer(-d, d)
+		return tf.get_variable("W", [rnn_size,1], initializer=initializer)
+		
+	def _build_comparison(self, reuse):
+		""" Applies the cell to fed gradients. Creates the variables of the optimizer unless reuse is True. """
+		#===# Comparison code #===#
+		self.input_grads = tf.placeholder(tf.float32, [1,None,1], 'input_grads') ### Remove first dimension?
+		input_grads = tf.squeeze(self.input_grads, [0])
+		
+		with tf.variable_scope("o1", reuse=reuse) as scope:
+			with rnn_cell.weight_mode(self.weight_mode):
 				h, self.rnn_state_out_compare = self.cell(input_grads, self.initial_rnn_state)
+		
+			W = self._get_output_weights()
+			update = tf.matmul(h,W)
 			
+			update = tf.reshape(update, [-1,1])
+			self.update = inv_scale_grads(update)
+		
+	def calc_update(self, grads, rnn_state):
+		""" Returns the update [num_params,1] for the gradients grads [num_params,1] and the new RNN state """
+		with tf.variable_scope("optimizer"):
+			with tf.variable_scope("o1", reuse=True), rnn_cell.weight_mode(self.weight_mode):
+				h, rnn_state_out = self.cell(grads, rnn_state)
+				
 				W = tf.get_variable("W")
 				update = tf.matmul(h,W)
-				
 				update = tf.reshape(update, [-1,1])
-				self.update = inv_scale_grads(update)
+				return inv_scale_grads(update), rnn_state_out
+				
+				
+class ParamLayout(object):
+	"""
+	Position of each of vars in the flat [size,1] vector of all their parameters, in the order
+	of vars. The offsets are computed once from the static shapes so the vector is split with
+	constant slices.
+	"""
+
+	def __init__(self, vars):
+		self.vars = list(vars)
+		self.shapes = [v.get_shape().as_list() for v in self.vars]
+		self.sizes = [int(np.prod(shape)) for shape in self.shapes]
+		self.offsets = [int(offset) for offset in np.cumsum([0] + self.sizes[:-1])]
+		self.size = sum(self.sizes)
+
+	def flatten(self, tensors):
+		""" Concatenates tensors with the shapes of the variables, eg their gradients """
+		return tf.concat(0, [tf.reshape(t,[-1,1]) for t in tensors])
+
+	def split(self, flat):
+		""" Inverse of flatten """
+		return [tf.reshape(tf.slice(flat, [offset,0], [size,1]), shape)
+				for offset,size,shape in zip(self.offsets, self.sizes, self.shapes)]
+
+	def scatter_add(self, flat):
+		""" Adds the flat vector to the variables """
+		return tf.group(*[v.assign_add(t) for v,t in zip(self.vars, self.split(flat))])
+
+	def chunks(self, chunk_size):
+		"""
+		Splits the flat vector into contiguous chunks of at most chunk_size parameters which end 
+		on row boundaries of the variables, so each chunk can be applied with scatter_add.
+		Returns a list of chunks, each a list of (variable index, first row, end row).
+		A row of more than chunk_size parameters is a chunk of its own.
+		"""
+		chunks = [[]]
+		chunk_params = 0
+		
+		for i,(shape,size) in enumerate(zip(self.shapes, self.sizes)):
+			num_rows = shape[0] if shape else 1
+			row_size = size//num_rows
+			row = 0
 			
+			while row < num_rows:
+				num_fitting = (chunk_size - chunk_params)//row_size
+				if num_fitting <= 0 and chunk_params > 0:
+					chunks.append([])
+					chunk_params = 0
+					continue
+					
+				end = min(num_rows, row + max(num_fitting,1))
+				chunks[-1].append((i, row, end))
+				chunk_params += (end - row)*row_size
+				row = end
+				
+		return chunks
+		
+	def shards(self, num_shards):
+		"""
+		Splits the flat vector into num_shards contiguous chunks of about size/num_shards 
+		parameters, in the format of chunks. The k-th boundary is the row boundary nearest to 
+		k*size/num_shards, so rounding to rows never adds a shard. There are fewer shards only 
+		if the variables have fewer rows in total.
+		"""
+		# Position of the end of every row in the flat vector
+		row_ends = np.concatenate([offset + (size//self._num_rows(i))*np.arange(1, self._num_rows(i)+1)
+								for i,(offset,size) in enumerate(zip(self.offsets, self.sizes))])
+		num_shards = min(num_shards, len(row_ends))
+		ends = []
+		j = -1
+		
+		for shard in range(1, num_shards):
+			target = shard*self.size/num_shards
+			j_nearest = np.searchsorted(row_ends, target)
+			if j_nearest > 0 and target - row_ends[j_nearest-1] <= row_ends[j_nearest] - target:
+				j_nearest -= 1
+			# Every shard gets at least one row
+			j = int(np.clip(j_nearest, j + 1, len(row_ends) - 1 - (num_shards - shard)))
+			ends.append(int(row_ends[j]))
+		ends.append(self.size)
+		
+		shards = []
+		start = 0
+		for end in ends:
+			shard = []
+			for i,(offset,size) in enumerate(zip(self.offsets, self.sizes)):
+				if max(start, offset) < min(end, offset + size):
+					row_size = size//self._num_rows(i)
+					shard.append((i, (max(start, offset) - offset)//row_size, (min(end, offset + size) - offset)//row_size))
+			shards.append(shard)
+			start = end
 			
-	# Update the parameters of another network (eg an MLP)
-	def update_params(self, vars, update):
-		total = 0
-		ret = []
-
-		for i,v in enumerate(vars):
-			size = np.prod(list(v.get_shape()))
-			size = tf.to_int32(size)
-			var_grads = tf.slice(update,begin=[total,0],size=[size,-1])
-			var_grads = tf.reshape(var_grads,v.get_shape())
-			ret.append(v.assign_add(var_grads))
-			size += total		
-		return tf.group(*ret)
-		
-		
-def tf_norm(v):
-	return tf.sqrt(tf.reduce_sum(tf.square(v)))
+		return shards
+		
+	def chunk_range(self, chunk):
+		""" Offset and size of a chunk in the flat vector """
+		offsets = [self.offsets[i] + row*self.sizes[i]//self._num_rows(i) for i,row,end in chunk]
+		size = sum((end - row)*self.sizes[i]//self._num_rows(i) for i,row,end in chunk)
+		return offsets[0], size
+		
+	def scatter_add_chunk(self, chunk, flat):
+		""" Adds flat, the [size,1] part of the flat vector covered by chunk, to the rows of the variables """
+		ops = []
+		offset = 0
+		
+		for i,row,end in chunk:
+			v = self.vars[i]
+			shape = self.shapes[i]
+			size = (end - row)*self.sizes[i]//self._num_rows(i)
+			part = tf.slice(flat, [offset,0], [size,1])
+			
+			if shape:
+				ops.append(tf.scatter_add(v, tf.range(row, end), tf.reshape(part, [end - row] + shape[1:])))
+			else:
+				ops.append(v.assign_add(tf.reshape(part, [])))
+			offset += size
+			
+		return tf.group(*ops)
+		
+	def _num_rows(self, i):
+		return self.shapes[i][0] if self.shapes[i] else 1
+		
+		
+def tf_norm(v, reduction_indices=None):
+	return tf.sqrt(tf.reduce_sum(tf.square(v), reduction_indices=reduction_indices))
 		
@@ -0,0 +1,59 @@
+from __future__ import division
+import threading
+
+import tensorflow as tf
+
+from constants import m, prefetch_capacity
+
+
+class Prefetcher(object):
+	"""
+	Samples batches from the replay memory in a background thread and stages them in a
+	FIFOQueue, so the next batch is ready as soon as the previous unroll finishes.
+	batch holds the dequeued indices, importance weights, points, RNN states, counters and
+	SNF ids in the order returned by ReplayMemory.sample.
+	"""
+
+	def __init__(self, replay_memory, batch_size, capacity=prefetch_capacity):
+		self.replay_memory = replay_memory
+		self.batch_size = batch_size
+
+		# The replay memory is read by the background thread and written by the training loop
+		self.lock = threading.Lock()
+		self.stop_event = threading.Event()
+		self.thread = None
+
+		state_size = replay_memory.state_size
+		dtypes = [tf.int32, tf.float32, tf.float32, tf.float32, tf.int32, tf.int32]
+		shapes = [[batch_size], [batch_size], [batch_size,m,1], [batch_size,m,state_size], [batch_size], [batch_size]]
+
+		with tf.name_scope("prefetch"):
+			self.placeholders = [tf.placeholder(dtype, shape) for dtype,shape in zip(dtypes,shapes)]
+			self.queue = tf.FIFOQueue(capacity, dtypes, shapes)
+			self.enqueue = self.queue.enqueue(self.placeholders)
+			self.close = self.queue.close(cancel_pending_enqueues=True)
+			self.batch = self.queue.dequeue()
+
+	def inputs(self):
+		""" Tensors which replace the input placeholders of the Optimizer """
+		indices, sample_weights, points, rnn_states, counters, snf_ids = self.batch
+		return {'point': points, 'snf_index': snf_ids, 'rnn_states': rnn_states, 'sample_weights': sample_weights}
+
+	def start(self, sess):
+		self.thread = threading.Thread(target=self._run, args=(sess,))
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _run(self, sess):
+		while not self.stop_event.is_set():
+			with self.lock:
+				batch = self.replay_memory.sample(self.batch_size)
+			try:
+				sess.run(self.enqueue, feed_dict=dict(zip(self.placeholders, batch)))
+			except tf.errors.CancelledError:
+				return
+
+	def stop(self, sess):
+		self.stop_event.set()
+		sess.run(self.close)
+		self.thread.join()
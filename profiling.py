@@ -0,0 +1,177 @@
+from __future__ import division
+import os
+import threading
+import time
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+from nn_utils import make_dir, make_parent_dir
+
+
+class _NullPhase(object):
+	def __enter__(self):
+		pass
+
+	def __exit__(self, *args):
+		pass
+
+
+class _Phase(object):
+	def __init__(self, timer, name):
+		self.timer = timer
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.time()
+
+	def __exit__(self, *args):
+		self.timer.totals[self.name] = self.timer.totals.get(self.name, 0.0) + time.time() - self.start
+
+
+class PhaseTimer(object):
+	"""
+	Records the wall time spent in each phase of the training loop and the throughput of the
+	unrolls. flush() writes the totals since the previous flush as TensorBoard summaries to
+	log_dir and as a row of csv_path. When disabled, phase() returns a shared object which does
+	nothing, so the instrumentation can stay in the loop at a negligible cost.
+	"""
+	phases = ['sample', 'unroll', 'store', 'grad_average', 'train_step', 'save']
+
+	def __init__(self, enabled=False, log_dir=None, csv_path=None):
+		self.enabled = enabled
+		self.null_phase = _NullPhase()
+		self.totals = {}
+		self.samples = 0
+		self.unroll_steps = 0
+		self.start = time.time()
+
+		self.writer = None
+		self.csv_file = None
+		if enabled and log_dir is not None:
+			self.writer = tf.train.SummaryWriter(log_dir)
+		if enabled and csv_path is not None:
+			make_parent_dir(csv_path)
+			self.csv_file = open(csv_path, 'w')
+			self.csv_file.write(','.join(['iteration'] + self.phases + ['samples_per_sec', 'unroll_steps_per_sec']) + '\n')
+
+	def phase(self, name):
+		if not self.enabled:
+			return self.null_phase
+		return _Phase(self, name)
+
+	def count(self, samples, unroll_steps):
+		self.samples += samples
+		self.unroll_steps += unroll_steps
+
+	def flush(self, iteration):
+		""" Writes and resets the counters. Returns the samples and unroll steps per second. """
+		if not self.enabled:
+			return 0, 0
+
+		elapsed = time.time() - self.start
+		samples_per_sec = self.samples/elapsed
+		unroll_steps_per_sec = self.unroll_steps/elapsed
+		times = [self.totals.get(name, 0.0) for name in self.phases]
+
+		if self.writer is not None:
+			values = [tf.Summary.Value(tag='time/' + name, simple_value=t) for name,t in zip(self.phases,times)]
+			values.append(tf.Summary.Value(tag='throughput/samples_per_sec', simple_value=samples_per_sec))
+			values.append(tf.Summary.Value(tag='throughput/unroll_steps_per_sec', simple_value=unroll_steps_per_sec))
+			self.writer.add_summary(tf.Summary(value=values), iteration)
+			self.writer.flush()
+
+		if self.csv_file is not None:
+			self.csv_file.write(','.join(str(x) for x in [iteration] + times + [samples_per_sec, unroll_steps_per_sec]) + '\n')
+			self.csv_file.flush()
+
+		self.totals = {}
+		self.samples = 0
+		self.unroll_steps = 0
+		self.start = time.time()
+		return samples_per_sec, unroll_steps_per_sec
+
+	def close(self):
+		if self.writer is not None:
+			self.writer.close()
+		if self.csv_file is not None:
+			self.csv_file.close()
+
+
+# Used by functions which take an optional timer
+null_timer = PhaseTimer()
+
+
+class _TracedSession(object):
+	""" Forwards to a session, tracing every call to run """
+	def __init__(self, sess, tracer, prefix):
+		self.sess = sess
+		self.tracer = tracer
+		self.prefix = prefix
+
+	def run(self, fetches, feed_dict=None):
+		return self.tracer.run(self.sess, self.prefix, fetches, feed_dict)
+
+	def __getattr__(self, name):
+		return getattr(self.sess, name)
+
+
+class Tracer(object):
+	"""
+	Runs the selected steps with full tracing. Each traced run is written to trace_dir as a
+	Chrome trace (open it at chrome://tracing) and the time of every op is added to a table,
+	ops.csv, which is sorted by total time. Ops inside a while loop are run once per iteration
+	and are summed into a single row.
+	"""
+
+	def __init__(self, steps, trace_dir):
+		self.steps = set(steps)
+		self.trace_dir = trace_dir
+		self.lock = threading.Lock() # Runs of the same step may be traced concurrently
+		self.num_traces = 0
+		self.op_stats = {} # Node name -> [op type, count, total microseconds]
+
+		if self.steps:
+			make_dir(trace_dir)
+
+	def session(self, sess, step, prefix='step'):
+		""" Returns sess itself if the step is not traced """
+		if step not in self.steps:
+			return sess
+		return _TracedSession(sess, self, '{}{}'.format(prefix, step))
+
+	def run(self, sess, prefix, fetches, feed_dict=None):
+		run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+		run_metadata = tf.RunMetadata()
+		res = sess.run(fetches, feed_dict=feed_dict, options=run_options, run_metadata=run_metadata)
+
+		trace = timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format()
+
+		with self.lock:
+			path = os.path.join(self.trace_dir, '{}_{}.json'.format(prefix, self.num_traces))
+			self.num_traces += 1
+			with open(path, 'w') as f:
+				f.write(trace)
+
+			for dev_stats in run_metadata.step_stats.dev_stats:
+				for node_stats in dev_stats.node_stats:
+					self._add_node_stats(node_stats)
+			self.write_op_table()
+
+		return res
+
+	def _add_node_stats(self, node_stats):
+		# The label has the form 'name = OpType(inputs)'
+		label = node_stats.timeline_label
+		op_type = label.split(' = ')[1].split('(')[0] if ' = ' in label else ''
+
+		stats = self.op_stats.setdefault(node_stats.node_name, [op_type, 0, 0])
+		stats[1] += 1
+		stats[2] += node_stats.all_end_rel_micros
+
+	def write_op_table(self):
+		rows = sorted(self.op_stats.items(), key=lambda item: -item[1][2])
+		with open(os.path.join(self.trace_dir, 'ops.csv'), 'w') as f:
+			f.write('op,type,count,total_ms,mean_us\n')
+			for name,(op_type,count,total) in rows:
+				f.write('{},{},{},{:.3f},{:.1f}\n'.format(name, op_type, count, total/1000, total/count))
@@ -0,0 +1,210 @@
+from __future__ import division
+
+import numpy as np
+
+from constants import m, rnn_size, num_rnn_layers, rnn_type, episode_length, replay_memory_dtype, \
+		priority_alpha, priority_beta, priority_eps, prioritized_replay
+from snf import gen_points
+
+
+def create_replay_memory(size, start_size, num_snfs):
+	""" Creates the replay memory selected in constants and adds start_size new states to it """
+	if prioritized_replay:
+		replay_memory = PrioritizedReplayMemory(size, num_snfs)
+	else:
+		replay_memory = ReplayMemory(size, num_snfs)
+	replay_memory.add(*replay_memory.new_states(start_size))
+	return replay_memory
+	
+	
+class ReplayMemory(object):
+	"""
+	Ring buffer of SNF states. Each attribute of the states is held in a single preallocated
+	array, so adding and sampling a batch of states costs a few array operations rather than
+	one Python object per state.
+	Points and RNN states are stored as dtype and converted back to float32 when sampled.
+	"""
+
+	def __init__(self, size, num_snfs, dtype=replay_memory_dtype):
+		self.size = size
+		self.num_snfs = num_snfs
+		self.dtype = np.dtype(dtype)
+
+		if rnn_type == 'lstm':
+			self.state_size = 2*rnn_size*num_rnn_layers
+		else:
+			self.state_size = rnn_size*num_rnn_layers
+
+		self.points = np.zeros([size,m], dtype=self.dtype)
+		self.rnn_states = np.zeros([size,m,self.state_size], dtype=self.dtype)
+		self.counters = np.zeros([size], dtype=np.int32)
+		self.snf_ids = np.zeros([size], dtype=np.int32)
+
+		self.num_entries = 0
+		self.next_index = 0 # Position of the oldest entry once the memory is full
+
+	def __len__(self):
+		return self.num_entries
+		
+	def nbytes(self):
+		return self.points.nbytes + self.rnn_states.nbytes + self.counters.nbytes + self.snf_ids.nbytes
+		
+	def nbytes_per_entry(self):
+		return self.nbytes()/self.size
+
+	def get_state(self):
+		""" Returns the contents of the memory as a dict of arrays, eg for np.savez """
+		n = self.num_entries
+		return {'points': self.points[:n], 'rnn_states': self.rnn_states[:n], 'counters': self.counters[:n], 
+				'snf_ids': self.snf_ids[:n], 'next_index': self.next_index}
+				
+	def set_state(self, state):
+		""" Restores the contents returned by get_state """
+		n = len(state['counters'])
+		self.points[:n] = state['points']
+		self.rnn_states[:n] = state['rnn_states']
+		self.counters[:n] = state['counters']
+		self.snf_ids[:n] = state['snf_ids']
+		self.num_entries = n
+		self.next_index = int(state['next_index'])
+
+	def new_states(self, num_states):
+		""" Returns the points, RNN states, counters and SNF ids of new episodes on random SNFs """
+		points = np.transpose(gen_points(num_states)) # [n,m]
+		rnn_states = np.zeros([num_states,m,self.state_size])
+		counters = np.ones([num_states], dtype=np.int32)
+		snf_ids = np.random.randint(self.num_snfs, size=num_states)
+		return points, rnn_states, counters, snf_ids
+
+	def add(self, points, rnn_states, counters, snf_ids):
+		""" Inserts a batch of states, overwriting the oldest ones when the memory is full """
+		num_states = len(counters)
+		indices = (self.next_index + np.arange(num_states)) % self.size
+
+		self.points[indices] = np.reshape(points,[num_states,m])
+		self.rnn_states[indices] = rnn_states
+		self.counters[indices] = counters
+		self.snf_ids[indices] = snf_ids
+
+		self.next_index = (self.next_index + num_states) % self.size
+		self.num_entries = min(self.num_entries + num_states, self.size)
+
+	def sample_indices(self, batch_size):
+		""" Returns the indices of a batch of states and their importance weights """
+		indices = np.random.randint(self.num_entries, size=batch_size)
+		return indices, np.ones([batch_size], dtype=np.float32)
+		
+	def update_priorities(self, indices, losses):
+		# Sampling is uniform so the losses are not used
+		pass
+
+	def sample(self, batch_size):
+		"""
+		Samples a batch of starting states. States at the end of their episode are replaced
+		by new ones in the returned batch but are left in the memory.
+		Returns the indices, importance weights, points [n,m,1], RNN states, counters and 
+		SNF ids of the batch.
+		"""
+		indices, weights = self.sample_indices(batch_size)
+
+		# Fancy indexing copies, so the resets below do not modify the memory
+		points = self.points[indices].astype(np.float32)
+		rnn_states = self.rnn_states[indices].astype(np.float32)
+		counters = self.counters[indices]
+		snf_ids = self.snf_ids[indices]
+
+		reset = counters >= episode_length
+		num_reset = np.sum(reset)
+		if num_reset > 0:
+			points[reset], rnn_states[reset], counters[reset], snf_ids[reset] = self.new_states(num_reset)
+
+		points = np.reshape(points,[batch_size,m,1])
+		return indices, weights, points, rnn_states, counters, snf_ids
+		
+		
+class PrioritizedReplayMemory(ReplayMemory):
+	"""
+	Samples states with probability proportional to (|loss| + priority_eps)^priority_alpha,
+	where loss is the total_loss of the last unroll that started from the state. New states
+	are given the highest priority seen so far so that they are sampled at least once.
+	"""
+
+	def __init__(self, size, num_snfs, dtype=replay_memory_dtype):
+		ReplayMemory.__init__(self, size, num_snfs, dtype)
+		self.tree = SumTree(size)
+		self.max_priority = 1.0
+		
+	def add(self, points, rnn_states, counters, snf_ids):
+		num_states = len(counters)
+		indices = (self.next_index + np.arange(num_states)) % self.size
+		ReplayMemory.add(self, points, rnn_states, counters, snf_ids)
+		self.tree.update(indices, np.ones([num_states])*self.max_priority)
+		
+	def get_state(self):
+		state = ReplayMemory.get_state(self)
+		state['priorities'] = self.tree.nodes[self.tree.capacity:self.tree.capacity + self.num_entries]
+		state['max_priority'] = self.max_priority
+		return state
+		
+	def set_state(self, state):
+		ReplayMemory.set_state(self, state)
+		self.tree.update(np.arange(self.num_entries), state['priorities'])
+		self.max_priority = float(state['max_priority'])
+		
+	def sample_indices(self, batch_size):
+		indices, priorities = self.tree.sample(batch_size)
+		
+		# Importance weights correct for the bias introduced by prioritization
+		probs = priorities/self.tree.total()
+		weights = np.power(self.num_entries*probs, -priority_beta)
+		weights /= np.max(weights)
+		return indices, weights.astype(np.float32)
+		
+	def update_priorities(self, indices, losses):
+		priorities = np.power(np.abs(losses) + priority_eps, priority_alpha)
+		self.max_priority = max(self.max_priority, np.max(priorities))
+		self.tree.update(indices, priorities)
+		
+		
+class SumTree(object):
+	"""
+	Binary tree in which each node holds the sum of its children's values, stored in a single
+	array with the root at index 1 and the children of node i at 2i and 2i+1. Updating and
+	sampling a batch both take O(batch_size*log(size)), vectorized over the batch.
+	"""
+
+	def __init__(self, size):
+		self.capacity = 1
+		while self.capacity < size:
+			self.capacity *= 2
+		self.nodes = np.zeros([2*self.capacity])
+		
+	def total(self):
+		return self.nodes[1]
+		
+	def update(self, indices, values):
+		if len(indices) == 0:
+			return
+		nodes = indices + self.capacity
+		self.nodes[nodes] = values
+		
+		# Recompute the sums of the affected nodes, one level at a time
+		while nodes[0] > 1:
+			nodes = np.unique(nodes//2)
+			self.nodes[nodes] = self.nodes[2*nodes] + self.nodes[2*nodes+1]
+			
+	def sample(self, batch_size):
+		""" Stratified sampling of leaves in proportion to their values. Returns their indices and values. """
+		segment = self.total()/batch_size
+		targets = (np.arange(batch_size) + np.random.rand(batch_size))*segment
+		
+		nodes = np.ones([batch_size], dtype=np.int64)
+		while nodes[0] < self.capacity:
+			left = 2*nodes
+			# Rounding errors must not lead to an empty subtree
+			go_right = (targets >= self.nodes[left]) & (self.nodes[left+1] > 0)
+			targets -= self.nodes[left]*go_right
+			nodes = left + go_right
+			
+		indices = nodes - self.capacity
+		return indices, self.nodes[nodes]
@@ -3,6 +3,7 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import contextlib
 import math
 
 import six
@@ -241,6 +242,48 @@ class GRUCell(RNNCell):
     return new_h, new_h
 
 
+class FusedGRUCell(GRUCell):
+  """GRUCell which does not concatenate its inputs and state.
+
+  It has the same variables as GRUCell, so either can restore the other's
+  weights. The weight matrices are split into their input and state rows
+  instead, the gate projection of the state is a single matmul and an input
+  with one column, as in the coordinate-wise optimizer, is applied by a
+  broadcast multiplication.
+  """
+
+  def __call__(self, inputs, state, scope=None):
+    """Gated recurrent unit (GRU) with nunits cells."""
+    input_size = inputs.get_shape().as_list()[1]
+    total_arg_size = input_size + self._num_units
+    with tf.variable_scope(scope or "GRUCell"):
+      with tf.variable_scope("Gates"):  # Reset gate and update gate.
+        with tf.variable_scope("Linear"):
+          matrix = _linear_matrix(total_arg_size, 2 * self._num_units)
+        gates = _split_linear(inputs, state, matrix, input_size)
+        r, u = tf.split(1, 2, tf.sigmoid(gates))
+      with tf.variable_scope("Candidate"):
+        with tf.variable_scope("Linear"):
+          matrix = _linear_matrix(total_arg_size, self._num_units)
+        c = self._activation(_split_linear(inputs, r * state, matrix, input_size))
+      # Equal to u * state + (1 - u) * c
+      new_h = c + u * (state - c)
+    return new_h, new_h
+
+
+def _split_linear(inputs, state, matrix, input_size):
+  """Equal to tf.matmul(tf.concat(1, [inputs, state]), matrix)."""
+  if matrix.get_shape().ndims == 3:
+    return _matmul(tf.concat(1, [inputs, state]), matrix)
+  input_rows = tf.slice(matrix, [0, 0], [input_size, -1])
+  state_rows = tf.slice(matrix, [input_size, 0], [-1, -1])
+  if input_size == 1:
+    input_term = inputs * input_rows  # [batch, 1] * [1, n]
+  else:
+    input_term = tf.matmul(inputs, input_rows)
+  return input_term + tf.matmul(state, state_rows)
+
+
 _LSTMStateTuple = collections.namedtuple("LSTMStateTuple", ("c", "h"))
 
 
@@ -849,6 +892,129 @@ class _SlimRNNCell(RNNCell):
     return output, state
 
 
+_WEIGHT_CACHE = "weight_cache"
+_WEIGHT_REFRESH = "weight_refresh"
+_weight_modes = ["sample"]
+_per_sample_weights = [None]
+
+
+@contextlib.contextmanager
+def weight_mode(mode):
+  """Sets the weight matrix used by the cells called within the context.
+
+  Args:
+    mode: "sample" draws a new noisy matrix square(W_m) * tanh(U - W_p),
+      U ~ U(-1, 1), on every run, as in training. "expected" uses its expected
+      value and "snapshot" a single sample. These two are cached in
+      non-trainable variables, so each call of a cell is a plain matmul. They
+      must be created outside of any while loop and are only set by running
+      refresh_weights(), eg after restoring W_m and W_p.
+  """
+  _weight_modes.append(mode)
+  try:
+    yield
+  finally:
+    _weight_modes.pop()
+
+
+@contextlib.contextmanager
+def per_sample_weights(offsets, noise):
+  """Gives each sample of the batch its own copy of the weights of the cells.
+
+  The rows of the inputs and state of a cell are grouped by sample, with the
+  same number of contiguous rows for every sample. Each sample has its own
+  noisy matrices, so the gradient with respect to an offset is the gradient of
+  each sample's loss with respect to the weight. Only cells whose weights are
+  created by _linear_matrix are supported.
+
+  Args:
+    offsets: dict from the name of each W_m and W_p variable to a zero tensor
+      of shape [num_samples] + its shape, which is added to it. The offsets
+      must be created outside of any while loop.
+    noise: dict from the name of each W_m variable to the U(-1, 1) draws of
+      the noisy matrices of the samples, of shape [num_samples] + its shape.
+  """
+  _per_sample_weights.append((offsets, noise))
+  try:
+    yield
+  finally:
+    _per_sample_weights.pop()
+
+
+def refresh_weights():
+  """Op which recomputes every cached weight matrix of the default graph."""
+  return tf.group(*tf.get_collection(_WEIGHT_REFRESH))
+
+
+def _log_cosh(x):
+  # Does not overflow for large |x|
+  x = tf.abs(x)
+  return x + tf.log(1.0 + tf.exp(-2.0 * x)) - math.log(2.0)
+
+
+def _sampled_matrix(W_m, W_p, rand=None):
+  if rand is None:
+    rand = tf.random_uniform(W_m.get_shape(), minval=-1.0, maxval=1.0)
+  # Element-wise multiplication
+  return tf.mul(tf.square(W_m), (tf.nn.tanh(rand - W_p)))
+
+
+def _expected_matrix(W_m, W_p):
+  # E[tanh(U - p)] = 0.5 * (log cosh(1 - p) - log cosh(1 + p)) for U ~ U(-1, 1)
+  return tf.mul(tf.square(W_m), 0.5 * (_log_cosh(1.0 - W_p) - _log_cosh(1.0 + W_p)))
+
+
+def _weight_matrix(W_m, W_p):
+  """The weight matrix of W_m and W_p in the current weight_mode."""
+  mode = _weight_modes[-1]
+  if mode == "sample":
+    return _sampled_matrix(W_m, W_p)
+
+  # Cells called several times, eg with reused variables, share the cache
+  key = (W_m.name, mode)
+  for cached_key, matrix in tf.get_collection(_WEIGHT_CACHE):
+    if cached_key == key:
+      return matrix
+
+  if mode == "expected":
+    value = _expected_matrix(W_m, W_p)
+  elif mode == "snapshot":
+    value = _sampled_matrix(W_m, W_p)
+  else:
+    raise ValueError("Unknown weight mode: %s" % mode)
+
+  # A variable created in a while loop would be initialized from a value of the loop
+  if tf.get_default_graph()._get_control_flow_context() is not None:
+    raise ValueError("The %s matrix of %s must be created outside of any while loop, "
+                     "eg by calling the cell once before the loop" % (mode, W_m.name))
+
+  matrix = tf.Variable(tf.zeros(W_m.get_shape()), trainable=False, name=mode + "_matrix")
+  tf.add_to_collection(_WEIGHT_CACHE, (key, matrix))
+  tf.add_to_collection(_WEIGHT_REFRESH, matrix.assign(value))
+  return matrix
+
+
+def _linear_matrix(total_arg_size, output_size):
+  """The weight matrix of _linear, created in the current variable scope."""
+  W_m = tf.get_variable("W_m", [total_arg_size, output_size], initializer=xavier_initializer([total_arg_size, output_size]))
+  W_p = tf.get_variable("W_p", [total_arg_size, output_size], initializer=xavier_initializer([total_arg_size, output_size]))
+  if _per_sample_weights[-1] is not None:
+    offsets, noise = _per_sample_weights[-1]
+    return _sampled_matrix(W_m + offsets[W_m.name], W_p + offsets[W_p.name], noise[W_m.name])
+  return _weight_matrix(W_m, W_p)
+
+
+def _matmul(inputs, matrix):
+  """tf.matmul, or the rows of each sample times its own matrix for a matrix of
+  shape [num_samples, input_size, output_size], see per_sample_weights."""
+  if matrix.get_shape().ndims == 2:
+    return tf.matmul(inputs, matrix)
+  input_size = inputs.get_shape()[1].value
+  output_size = matrix.get_shape()[2].value
+  inputs = tf.reshape(inputs, tf.pack([tf.shape(matrix)[0], -1, input_size]))
+  return tf.reshape(tf.batch_matmul(inputs, matrix), [-1, output_size])
+
+
 def _linear(args, output_size, bias, bias_start=0.0, scope=None):
   """Linear map: sum_i(args[i] * W[i]), where W[i] is a variable.
 
@@ -884,16 +1050,12 @@ def _linear(args, output_size, bias, bias_start=0.0, scope=None):
 
   # Now the computation.
   with tf.variable_scope(scope or "Linear"):
-    rand = tf.random_uniform([total_arg_size, output_size], minval=-1.0, maxval=1.0)
-    W_m = tf.get_variable("W_m", [total_arg_size, output_size], initializer=xavier_initializer([total_arg_size, output_size]))
-    W_p = tf.get_variable("W_p", [total_arg_size, output_size], initializer=xavier_initializer([total_arg_size, output_size]))
-    # Element-wise multiplication
-    matrix = tf.mul(tf.square(W_m),(tf.nn.tanh(rand - W_p)))
+    matrix = _linear_matrix(total_arg_size, output_size)
     #matrix = tf.get_variable("Matrix", [total_arg_size, output_size])
     if len(args) == 1:
-      res = tf.matmul(args[0], matrix)
+      res = _matmul(args[0], matrix)
     else:
-      res = tf.matmul(tf.concat(1, args), matrix)
+      res = _matmul(tf.concat(1, args), matrix)
     if not bias:
       return res
     #bias_term = tf.get_variable(
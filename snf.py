@@ -3,29 +3,115 @@ from __future__ import division
 import tensorflow as tf
 import numpy as np
 
-from constants import k, m, var_size, rnn_size, num_rnn_layers, rnn_type
-from nn_utils import scale_grads, np_inv_scale_grads
+from constants import k, m, var_size, \
+		num_SNFs, snf_seed, snf_path, max_hyperplane_cond
+from nn_utils import scale_grads, np_scale_grads, make_parent_dir
 
 
 class SNF(object):
-	def __init__(self):
-		self.hyperplanes = np.random.rand(m*m*k)
+	def __init__(self, rng=np.random, record=None):
+		if record is not None:
+			# Loaded from a saved set of SNFs, see load_snfs
+			for field in snf_fields:
+				setattr(self, field, record[field])
+			return
+			
+		self.hyperplanes = rng.rand(m*m*k)
 		self.hyperplanes = np.reshape(self.hyperplanes,[m,m,k])
 		
-		self.variances = np.random.rand(k)*var_size
+		self.variances = rng.rand(k)*var_size
 		self.variances = np.reshape(self.variances,[k,1])
 		
-		self.weights = np.random.rand(k)
+		self.weights = rng.rand(k)
 		self.weights = np.reshape(self.weights,[k,1])
+		
+		# The hyperplane geometry only depends on the SNF so it is computed once here,
+		# rather than inverting the [k,m,m] matrices every time the loss is evaluated
+		hyperplanes = np.reshape(self.hyperplanes,[k,m,m])
+		a = np.linalg.solve(hyperplanes, np.ones([k,m,1])) # [k,m,1]
+		a = np.reshape(a,[k,m])
+		norm = np.sqrt(np.sum(np.square(a),axis=1,keepdims=True)) # [k,1]
+		self.normals = a/norm # [k,m]
+		self.offsets = 1/norm # [k,1]
+		
+	def is_well_conditioned(self):
+		# Nearly singular hyperplane matrices result in huge or NaN losses
+		hyperplanes = np.reshape(self.hyperplanes,[k,m,m])
+		return np.all(np.linalg.cond(hyperplanes) < max_hyperplane_cond)
+		
+		
+#===# Persistence #===#
+snf_fields = ['hyperplanes','variances','weights','normals','offsets']
+snf_dtype = np.dtype([	('hyperplanes', np.float64, (m,m,k)), 
+						('variances', np.float64, (k,1)), 
+						('weights', np.float64, (k,1)), 
+						('normals', np.float64, (k,m)), 
+						('offsets', np.float64, (k,1))])
+		
+		
+def gen_snfs(num_snfs, seed):
+	""" Reproducibly generates a set of SNFs, redrawing any that are ill-conditioned """
+	rng = np.random.RandomState(seed)
+	snfs = []
+	while len(snfs) < num_snfs:
+		snf = SNF(rng)
+		if snf.is_well_conditioned():
+			snfs.append(snf)
+	return snfs
+	
+	
+def save_snfs(path, snfs):
+	""" Writes a set of SNFs to a single .npy file of snf_dtype records """
+	records = np.zeros(len(snfs), dtype=snf_dtype)
+	for record,snf in zip(records,snfs):
+		for field in snf_fields:
+			record[field] = getattr(snf, field)
+			
+	make_parent_dir(path)
+	np.save(path, records)
 	
+	
+def load_snfs(path, num_snfs=num_SNFs):
+	""" 
+	Loads a set of num_snfs SNFs written by save_snfs. The file is memory-mapped rather than read.
+	Raises ValueError if it was written with other constants.
+	"""
+	records = np.load(path, mmap_mode='r')
+	if records.dtype != snf_dtype or records.ndim != 1:
+		raise ValueError("%s does not contain SNFs with m=%d and k=%d, found records of %s with shape %s" % 
+							(path, m, k, records.dtype, records.shape))
+	if len(records) != num_snfs:
+		raise ValueError("%s contains %d SNFs, expected %d" % (path, len(records), num_snfs))
+	return [SNF(record=record) for record in records]
+	
+	
+def stack_snfs(snfs):
+	""" Stacks the parameters of a list of SNFs for the batched loss functions """
+	normals = np.stack([snf.normals for snf in snfs]) # [n,k,m]
+	offsets = np.stack([snf.offsets for snf in snfs]) # [n,k,1]
+	variances = np.stack([snf.variances for snf in snfs]) # [n,k,1]
+	weights = np.stack([snf.weights for snf in snfs]) # [n,k,1]
+	return normals, offsets, variances, weights
+	
+		
+class SNFBank(object):
+	"""
+	Stores the parameters of a set of SNFs once as float32 variables so a graph can 
+	gather them by index rather than having them fed on every run
+	"""
+
+	def __init__(self, snfs):
+		normals, offsets, variances, weights = stack_snfs(snfs)
 		
-	def calc_loss_and_grads(self, point, state_ops, sess):
-		loss, grads = sess.run([state_ops.loss, state_ops.grads], 
-						feed_dict={	state_ops.point: point, 
-									state_ops.hyperplanes: self.hyperplanes, 
-									state_ops.variances: self.variances, 
-									state_ops.weights: self.weights})
-		return loss, grads
+		with tf.variable_scope("snf_bank"):
+			self.normals = tf.Variable(normals.astype(np.float32), trainable=False, name='normals') # [num_SNFs,k,m]
+			self.offsets = tf.Variable(offsets.astype(np.float32), trainable=False, name='offsets') # [num_SNFs,k,1]
+			self.variances = tf.Variable(variances.astype(np.float32), trainable=False, name='variances') # [num_SNFs,k,1]
+			self.weights = tf.Variable(weights.astype(np.float32), trainable=False, name='weights') # [num_SNFs,k,1]
+			
+	def gather(self, index):
+		""" Returns the normals, offsets, variances and weights of the SNF(s) at index """
+		return [tf.gather(v, index) for v in [self.normals, self.offsets, self.variances, self.weights]]
 		
 		
 def gen_points(num_points):
@@ -34,71 +120,79 @@ def gen_points(num_points):
 	return points
 	
 		
-def calc_snf_loss_tf(point,hyperplanes,variances,weights):
+def calc_snf_losses_tf(points,normals,offsets,variances,weights):
+	""" Computes the loss of each of n points, each on a different SNF
+	points: [n,m,1], normals: [n,k,m], offsets, variances and weights: [n,k,1]
+	"""
 	#variances = tf.maximum(variances,1e-6) # Avoid NaN errors
 	# Calculate the distance of the point from each hyperplane
-	hyperplanes = tf.reshape(hyperplanes, [k,m,m])
-	hp_inv = tf.batch_matrix_inverse(hyperplanes) # [k,m,m]
-	x = tf.ones((k,m,1))
-	a = tf.batch_matmul(hp_inv, x) # [k,m,1]
-	point = tf.reshape(point,[m,1])
-	a = tf.reshape(a,[k,m])
-	D = tf.matmul(a,point) - 1
-	D = tf.reshape(D,[k])
-	norm = tf.sqrt(tf.reduce_sum(tf.square(a),reduction_indices=[1])) # [k]
-	D /= norm#tf.maximum(norm,1e-6) # [k]
-	
-	losses = tf.square(D) # [k]
-	losses /= -2*variances # [k]
-	losses = -tf.exp(losses) # [k]
-	var_coeffs = 1/tf.sqrt(2*variances*3.14) # [k]
-	losses *= var_coeffs # [k]
-	losses *= weights # element-wise [k]
-	
-	loss = tf.reduce_mean(losses) # Average over the hyperplanes 
-	return loss
-	
-	
-def calc_grads_tf(loss,point):
-	grads = tf.gradients(loss,point)[0]
-	grads = tf.reshape(grads,[1,m,1])
+	# using the unit normals precomputed by SNF
+	D = tf.batch_matmul(normals,points) - offsets # [n,k,1]
+	D = tf.reshape(D,[-1,1,k])
+	
+	losses = tf.square(D) # [n,1,k]
+	losses /= -2*variances # [n,k,k]
+	losses = -tf.exp(losses) # [n,k,k]
+	var_coeffs = 1/tf.sqrt(2*variances*3.14) # [n,k,1]
+	losses *= var_coeffs # [n,k,k]
+	losses *= weights # element-wise [n,k,k]
+	
+	losses = tf.reduce_mean(losses,reduction_indices=[1,2]) # Average over the hyperplanes 
+	return losses
+	
+	
+def calc_snf_losses_and_grads_np(points,normals,offsets,variances,weights):
+	""" 
+	NumPy equivalent of calc_snf_losses_tf and calc_batch_grads_tf, 
+	with the gradient computed in closed form rather than by a session.
+	It is the reference the graph is checked against in test_snf.py.
+	points: [n,m,1], normals: [n,k,m], offsets, variances and weights: [n,k,1]
+	Returns the losses [n] and the scaled gradients [n,1,m,1]
+	"""
+	D = np.matmul(normals,points) - offsets # [n,k,1]
+	D = np.reshape(D,[-1,1,k])
+	
+	e = np.exp(np.square(D)/(-2*variances)) # [n,k,k]
+	var_coeffs = 1/np.sqrt(2*variances*3.14) # [n,k,1]
+	coeffs = var_coeffs*weights/(k*k) # [n,k,1], includes the mean over the hyperplanes
+	
+	losses = -np.sum(coeffs*e, axis=(1,2)) # [n]
+	
+	# d(loss)/dD_j = sum_i coeffs_i*e_ij*D_j/variances_i
+	dD = np.sum(coeffs*e/variances, axis=1)*D[:,0,:] # [n,k]
+	grads = np.matmul(dD[:,None,:],normals) # [n,1,m]
+	grads = np.reshape(grads,[-1,1,m,1])
+	grads = np_scale_grads(grads)
+	return losses, grads
+	
+	
+def calc_batch_grads_tf(losses,points):
+	# The points are independent so the gradient of the sum is the gradient of each loss
+	grads = tf.gradients(tf.reduce_sum(losses),points)[0]
+	grads = tf.reshape(grads,[-1,1,m,1])
 	grads = scale_grads(grads)
 	return grads
 		
 		
 class StateOps:
 	"""
-	The definition of this graph could be included within State but making it separate means 
-	the graph only has to be created once, as opposed to once every time an instance of State 
-	is created. This results in a 100-1000x speed-up.
+	The graph is created once and the parameters of the SNFs are fed to it, as opposed to 
+	creating a graph for every point. This results in a 100-1000x speed-up.
 	"""
 
 	def __init__(self): 
-		#===# Graph to compute the loss and gradients for a single point #===#
-		self.point = tf.placeholder(tf.float32, [m,1])
-		self.variances = tf.placeholder(tf.float32, [k,1])
-		self.weights = tf.placeholder(tf.float32, [k,1])
-		self.hyperplanes = tf.placeholder(tf.float32, [m,m,k]) # Points which define the hyperplanes
-		
-		self.loss = calc_snf_loss_tf(self.point,self.hyperplanes,self.variances,self.weights)
-		self.grads = calc_grads_tf(self.loss,self.point)
-
+		#===# Graph to compute the losses and gradients for many points, each on its own SNF #===#
+		self.point = tf.placeholder(tf.float32, [None,m,1])
+		self.variances = tf.placeholder(tf.float32, [None,k,1])
+		self.weights = tf.placeholder(tf.float32, [None,k,1])
+		self.normals = tf.placeholder(tf.float32, [None,k,m]) # Unit normals of the hyperplanes
+		self.offsets = tf.placeholder(tf.float32, [None,k,1]) # Distances of the hyperplanes from the origin
 		
-class State(object):
+		self.loss = calc_snf_losses_tf(self.point,self.normals,self.offsets,self.variances,self.weights) # [n]
+		self.grads = calc_batch_grads_tf(self.loss,self.point) # [n,1,m,1]
 
-	def __init__(self, snf, state_ops, sess):
-		self.snf = snf
-		self.point = gen_points(1)
-		self.counter = 1
-		self.loss_and_grads(snf, state_ops, sess) # calc and set
-		
-		if rnn_type == 'lstm':
-			self.rnn_state = np.zeros([m,2*rnn_size*num_rnn_layers])
-		else:
-			self.rnn_state = np.zeros([m,rnn_size*num_rnn_layers])
-		
-		
-	def loss_and_grads(self, snf, state_ops, sess):
-		[self.loss,self.grads] = snf.calc_loss_and_grads(self.point, state_ops, sess)
 		
-		
\ No newline at end of file
+if __name__ == "__main__":
+	# python snf.py
+	save_snfs(snf_path, gen_snfs(num_SNFs, snf_seed))
+	print "Saved %d SNFs to %s" % (num_SNFs, snf_path)
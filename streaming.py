@@ -0,0 +1,76 @@
+from __future__ import division
+import os
+import tempfile
+
+import tensorflow as tf
+import numpy as np
+
+from constants import streaming_chunk_size
+from nn_utils import make_parent_dir
+
+
+class StreamingOptimizer(object):
+	"""
+	Applies an optimizer to the variables of a ParamLayout in chunks of at most chunk_size
+	parameters. Only the RNN state, state_size values per parameter, is streamed: it is kept 
+	in a memory-mapped file and only the state of the current chunk is fed to the graph. The 
+	gradients of a step are still computed at once and fetched, so they take memory in 
+	proportion to the size of the net. A step then runs a single update graph on each chunk's 
+	part of the gradients, adds the update to the rows of the chunk with scatter_add and 
+	writes the chunk's new state back to the file.
+	"""
+
+	def __init__(self, opt_net, layout, grads, chunk_size=streaming_chunk_size, state_path=None):
+		"""
+		grads: Flat [layout.size,1] gradients of the variables of layout
+		state_path: File of the RNN states. If None a temporary file is created, which close removes.
+		"""
+		self.layout = layout
+		self.grads = grads
+		self.state_size = opt_net.state_size
+		
+		self.temp_file = state_path is None
+		if self.temp_file:
+			fd, state_path = tempfile.mkstemp(prefix='opt_net_state_', suffix='.dat')
+			os.close(fd)
+		self.state_path = state_path
+
+		# The optimizer is applied to any chunk by feeding its gradients and state
+		self.chunk_grads = tf.placeholder(tf.float32, [None,1], 'streaming_grads')
+		self.rnn_state = tf.placeholder(tf.float32, [None,self.state_size], 'streaming_rnn_state')
+		update, self.rnn_state_out = opt_net.calc_update(self.chunk_grads, self.rnn_state)
+
+		self.chunks = layout.chunks(chunk_size)
+		self.chunk_ranges = [layout.chunk_range(chunk) for chunk in self.chunks]
+		self.train_steps = [layout.scatter_add_chunk(chunk, update) for chunk in self.chunks]
+
+		self.reset()
+
+	def reset(self):
+		""" Sets the RNN state of every parameter to zero, run it together with the net's init """
+		make_parent_dir(self.state_path)
+
+		# Recreating the file zeroes it without writing every element
+		self.states = np.memmap(self.state_path, dtype=np.float32, mode='w+', shape=(self.layout.size, self.state_size))
+
+	def step(self, sess, feed_dict, fetches=None):
+		"""
+		Runs a step of the optimizer on the batch in feed_dict. fetches, eg the loss, are evaluated
+		before the update. Returns their values.
+		"""
+		fetches = fetches or []
+		res = sess.run([self.grads] + fetches, feed_dict=feed_dict)
+		grads = res[0]
+
+		for (offset,size),train_step in zip(self.chunk_ranges, self.train_steps):
+			feed_dict = {self.chunk_grads: grads[offset:offset + size], self.rnn_state: self.states[offset:offset + size]}
+			rnn_state_out,_ = sess.run([self.rnn_state_out, train_step], feed_dict=feed_dict)
+			self.states[offset:offset + size] = rnn_state_out
+
+		return res[1:]
+
+	def close(self):
+		""" Releases the file of the RNN states, removing it if it is temporary """
+		del self.states
+		if self.temp_file:
+			os.remove(self.state_path)
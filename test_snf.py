@@ -0,0 +1,55 @@
+from __future__ import division
+
+import tensorflow as tf
+import numpy as np
+
+from snf import SNF, StateOps, stack_snfs, calc_snf_losses_and_grads_np
+from nn_utils import np_inv_scale_grads
+from constants import m
+
+"""
+python -m pytest test_snf.py
+"""
+
+
+def gen_batch(n, seed=0):
+	rng = np.random.RandomState(seed)
+	snfs = [SNF(rng) for i in range(n)]
+	points = rng.rand(n,m,1)
+	return (points,) + stack_snfs(snfs)
+
+
+def test_np_matches_tf():
+	tf.reset_default_graph()
+	state_ops = StateOps()
+	sess = tf.Session()
+
+	for n in [1, 100]:
+		points, normals, offsets, variances, weights = gen_batch(n)
+		feed_dict = {	state_ops.point: points,
+						state_ops.normals: normals,
+						state_ops.offsets: offsets,
+						state_ops.variances: variances,
+						state_ops.weights: weights}
+
+		tf_losses, tf_grads = sess.run([state_ops.loss, state_ops.grads], feed_dict=feed_dict)
+		np_losses, np_grads = calc_snf_losses_and_grads_np(points, normals, offsets, variances, weights)
+
+		# The graph runs in float32 so only approximate agreement is expected
+		assert np.allclose(tf_losses, np_losses, rtol=1e-3, atol=1e-5), "Losses differ for n=%d" % n
+		assert np.allclose(tf_grads, np_grads, rtol=1e-3, atol=1e-5), "Gradients differ for n=%d" % n
+	sess.close()
+
+
+def test_np_grads_match_finite_differences():
+	points, normals, offsets, variances, weights = gen_batch(10)
+	_, grads = calc_snf_losses_and_grads_np(points, normals, offsets, variances, weights)
+	grads = np.reshape(np_inv_scale_grads(grads), [-1,m])
+
+	eps = 1e-6
+	for i in range(m):
+		step = np.zeros([1,m,1])
+		step[0,i,0] = eps
+		loss_plus,_ = calc_snf_losses_and_grads_np(points + step, normals, offsets, variances, weights)
+		loss_minus,_ = calc_snf_losses_and_grads_np(points - step, normals, offsets, variances, weights)
+		assert np.allclose(grads[:,i], (loss_plus - loss_minus)/(2*eps), rtol=1e-4, atol=1e-8)
@@ -0,0 +1,75 @@
+from __future__ import division
+
+import tensorflow as tf
+
+from nn_utils import cross_entropy
+
+"""
+Trains a net for a whole run inside a single tf.while_loop, so benchmarking an optimizer
+takes one session call and measures the optimizer rather than the Python loop and feeds.
+"""
+
+
+class Dataset(object):
+	"""
+	Images and labels stored in variables so batches can be drawn inside the graph. The
+	variables are initialized from placeholders, which keeps the data out of the GraphDef,
+	and are in no collection so they are neither reset by net.init nor saved.
+	"""
+
+	def __init__(self, num_examples, num_inputs=784, num_classes=10):
+		self.num_examples = num_examples
+		self.images_input = tf.placeholder(tf.float32, [num_examples, num_inputs], 'dataset_images')
+		self.labels_input = tf.placeholder(tf.float32, [num_examples, num_classes], 'dataset_labels')
+
+		self.images = tf.Variable(self.images_input, trainable=False, collections=[], name='dataset_images')
+		self.labels = tf.Variable(self.labels_input, trainable=False, collections=[], name='dataset_labels')
+
+	def load(self, sess, images, labels):
+		sess.run([self.images.initializer, self.labels.initializer],
+					feed_dict={self.images_input: images, self.labels_input: labels})
+
+	def sample(self, batch_size):
+		""" A batch drawn uniformly with replacement """
+		indices = tf.to_int32(tf.floor(tf.random_uniform([batch_size])*self.num_examples))
+		return tf.gather(self.images, indices), tf.gather(self.labels, indices)
+
+
+def build_training_loop(net, dataset, num_steps, optimizer=None):
+	"""
+	Returns the [num_steps] training losses of net when it is trained for num_steps by optimizer.
+	optimizer is one of the tf.train.Optimizer instances the net already applied to its
+	variables, such as net.adam_optimizer, so its slots exist before the loop. If it is None
+	the net is trained by net.opt_net, starting from the RNN state in net.opt_net_state.
+	Run net.init first to reset the net.
+	The batches are drawn with replacement, not in shuffled epochs as by mnist.train.next_batch,
+	so the losses are comparable between optimizers but not identical to those of a Python loop.
+	"""
+	vars = net.layout.vars
+	loss_ta = tf.TensorArray(dtype=tf.float32, size=num_steps)
+
+	def condition(time, loss_ta, rnn_state):
+		return tf.less(time, num_steps)
+
+	def body(time, loss_ta, rnn_state):
+		x, y_ = dataset.sample(net.batch_size)
+		loss = cross_entropy(net.forward(x), y_)
+		grads = tf.gradients(loss, vars)
+
+		if optimizer is None:
+			grads = net.layout.flatten(grads)
+			update, rnn_state = net.opt_net.calc_update(grads, rnn_state)
+			train_step = net.opt_net.update_params(net.layout, update)
+		else:
+			train_step = optimizer.apply_gradients(zip(grads, vars))
+
+		# The next step must read the variables after they have been updated
+		with tf.control_dependencies([train_step]):
+			loss_ta = loss_ta.write(time, loss)
+			rnn_state = tf.identity(rnn_state)
+			time = time + 1
+		return [time, loss_ta, rnn_state]
+
+	# The steps are sequential, each one updates the variables the next one reads
+	res = tf.while_loop(condition, body, [tf.constant(0), loss_ta, tf.identity(net.opt_net_state)], parallel_iterations=1)
+	return res[1].pack()